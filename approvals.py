@@ -0,0 +1,317 @@
+import logging
+import threading
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import CallbackContext
+from telegram.utils.helpers import escape_markdown
+
+from circuit_breaker import ServiceUnavailableError
+from claim_store import (
+    get_approval,
+    get_row_number,
+    normalise_claim_id,
+    record_sheet_claims,
+    set_approval,
+)
+from drive_connector import (
+    SAMPLE_RANGE_NAME,
+    add_claim_listener,
+    batch_get_ranges,
+    batch_update_ranges,
+    config,
+    fetch_sheet_pages,
+    tenant_registry,
+)
+from error_handling import notify_not_authorised
+from tenants import get_current_tenant, tenant_context
+from utils import is_admin
+
+logger = logging.getLogger(__name__)
+
+APPROVAL_CHAT_ID = config["approvals"]["chat_id"]
+APPROVAL_BATCH_DELAY = config["approvals"]["batch_delay_seconds"]
+PENDING_LIMIT = config["approvals"]["pending_limit"]
+
+# Positions of the columns in a claim row
+CLAIM_COLUMNS = [
+    "Claim ID",
+    "Department",
+    "Name",
+    "Date",
+    "Category",
+    "Amount",
+    "Description",
+]
+APPROVAL_STATUS_COLUMN = 7
+
+SHEET_NAME, SHEET_COLUMNS = SAMPLE_RANGE_NAME.split("!")
+CLAIM_ID_COL = SHEET_COLUMNS.split(":")[0]
+APPROVAL_STATUS_COL = chr(ord(CLAIM_ID_COL) + APPROVAL_STATUS_COLUMN)
+
+DECISIONS = {"approve": "Approved", "reject": "Rejected"}
+
+
+def get_approval_chat_id():
+    """Returns the current tenant's approval chat, or None if it has none."""
+    tenant = get_current_tenant()
+    if tenant.approval_chat_id is not None:
+        return tenant.approval_chat_id
+    return APPROVAL_CHAT_ID if tenant.is_default else None
+
+
+def get_approval_keyboard(claim_id: str, version: int) -> InlineKeyboardMarkup:
+    """Creates the Approve/Reject buttons, tagged with the version they were shown for."""
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    "✅ Approve", callback_data=f"approval:approve:{claim_id}:{version}"
+                ),
+                InlineKeyboardButton(
+                    "❌ Reject", callback_data=f"approval:reject:{claim_id}:{version}"
+                ),
+            ]
+        ]
+    )
+
+
+def format_approval_message(row: list[str], status: str, decided_by: str = None) -> str:
+    """Formats a claim row as the message shown to the approvers."""
+    # Claim details are typed by users, so escape them before they reach the Markdown
+    claim = {
+        column: escape_markdown(value) for column, value in zip(CLAIM_COLUMNS, row)
+    }
+    message = (
+        "🧾 *Claim for Approval*\n"
+        f"📌 *Department*: {claim.get('Department', '')}\n"
+        f"👤 *Name*: {claim.get('Name', '')}\n"
+        f"📅 *Date*: {claim.get('Date', '')}\n"
+        f"💼 *Category*: {claim.get('Category', '')}\n"
+        f"💰 *Amount*: {claim.get('Amount', '')}\n"
+        f"📝 *Description*: {claim.get('Description', '')}\n"
+        f"*Claim ID*: `{row[0]}`\n\n"
+        f"*Status*: {status}"
+    )
+    if decided_by:
+        message += f" (by {escape_markdown(decided_by)})"
+    return message
+
+
+def post_claim_for_approval(bot, row: list[str]) -> None:
+    """Sends a claim to the approval chat with inline Approve/Reject buttons."""
+    approval = get_approval(row[0], status=row[APPROVAL_STATUS_COLUMN] or "Pending")
+    bot.send_message(
+        chat_id=get_approval_chat_id(),
+        text=format_approval_message(row, approval["status"]),
+        reply_markup=get_approval_keyboard(row[0], approval["version"]),
+        parse_mode="Markdown",
+    )
+
+
+def post_new_claim(new_row: list[str], row_number: int) -> None:
+    """Claim listener that posts every newly appended claim to the approval chat."""
+    approval_bot = tenant_registry.get_bot(get_current_tenant())
+    if approval_bot is None or get_approval_chat_id() is None:
+        return
+    try:
+        post_claim_for_approval(approval_bot, new_row)
+    except TelegramError as err:
+        # The claim itself is saved, so never fail the submission over this
+        logger.error("Could not post claim %s for approval: %s", new_row[0], err)
+
+
+add_claim_listener(post_new_claim)
+
+
+def refresh_row_numbers(claim_ids: list[str]) -> dict:
+    """Re-reads the Claim ID column once to find rows that moved or were never cached."""
+    (cells,) = batch_get_ranges([f"{SHEET_NAME}!{CLAIM_ID_COL}2:{CLAIM_ID_COL}"])
+    positions = [
+        (cell[0], index + 2) for index, cell in enumerate(cells) if cell and cell[0]
+    ]
+    record_sheet_claims(positions)
+
+    wanted = set(claim_ids)
+    return {
+        normalise_claim_id(claim_id): row_number
+        for claim_id, row_number in positions
+        if normalise_claim_id(claim_id) in wanted
+    }
+
+
+def write_approval_statuses(statuses: dict) -> None:
+    """
+    Writes each claim's Approval Status cell in a single batchUpdate, using the
+    cached row positions. The cached positions are checked with one batchGet of
+    just those Claim ID cells, and only if some have moved is the column re-read.
+    """
+    rows = {claim_id: get_row_number(claim_id) for claim_id in statuses}
+    cached = {claim_id: row for claim_id, row in rows.items() if row is not None}
+
+    stale = [claim_id for claim_id, row in rows.items() if row is None]
+    if cached:
+        cells = batch_get_ranges(
+            [f"{SHEET_NAME}!{CLAIM_ID_COL}{row}" for row in cached.values()]
+        )
+        for (claim_id, _), cell in zip(cached.items(), cells):
+            if not cell or normalise_claim_id(cell[0][0]) != claim_id:
+                stale.append(claim_id)
+    if stale:
+        rows.update({claim_id: None for claim_id in stale})
+        rows.update(refresh_row_numbers(stale))
+
+    data = []
+    for claim_id, status in statuses.items():
+        if rows[claim_id] is None:
+            logger.error("Claim %s is not in the sheet, status not written", claim_id)
+            continue
+        data.append(
+            {
+                "range": f"{SHEET_NAME}!{APPROVAL_STATUS_COL}{rows[claim_id]}",
+                "values": [[status]],
+            }
+        )
+    if data:
+        batch_update_ranges(data)
+
+
+class ApprovalWriteBatcher:
+    """
+    Collects approval decisions made in quick succession and writes them to the
+    tenant's sheet together, so clearing a backlog costs one write request per batch.
+    """
+
+    def __init__(self, tenant_name: str, delay: float):
+        self.tenant_name = tenant_name
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.pending = {}  # normalised claim ID -> status
+        self.scheduled = False
+
+    def add(self, claim_id: str, status: str, job_queue) -> None:
+        with self.lock:
+            self.pending[normalise_claim_id(claim_id)] = status
+            if not self.scheduled:
+                self.scheduled = True
+                job_queue.run_once(self.flush, self.delay)
+
+    def flush(self, context: CallbackContext) -> None:
+        with self.lock:
+            statuses, self.pending = self.pending, {}
+            self.scheduled = False
+        if not statuses:
+            return
+        tenant = tenant_registry.get(self.tenant_name)
+        if tenant is None:
+            logger.error(
+                "Tenant %s was removed, approval decisions not written: %s",
+                self.tenant_name,
+                statuses,
+            )
+            return
+
+        try:
+            with tenant_context(tenant):
+                write_approval_statuses(statuses)
+            logger.info(
+                "Wrote %d approval decisions to the %s sheet",
+                len(statuses),
+                tenant.name,
+            )
+        except Exception as err:
+            # The claim store already has these decisions, so they must not be lost
+            if isinstance(err, ServiceUnavailableError):
+                logger.warning("Could not write approval decisions, retrying: %s", err)
+            else:
+                logger.exception("Writing approval decisions failed, retrying")
+            with self.lock:
+                # Decisions made since this batch started are newer, keep those
+                self.pending = {**statuses, **self.pending}
+                if not self.scheduled:
+                    self.scheduled = True
+                    context.job_queue.run_once(self.flush, self.delay * 10)
+
+
+approval_batchers = {}  # tenant name -> ApprovalWriteBatcher
+approval_batchers_lock = threading.Lock()
+
+
+def get_approval_batcher() -> ApprovalWriteBatcher:
+    """Returns the write batcher of the current tenant, creating it on first use."""
+    tenant_name = get_current_tenant().name
+    with approval_batchers_lock:
+        if tenant_name not in approval_batchers:
+            approval_batchers[tenant_name] = ApprovalWriteBatcher(
+                tenant_name, APPROVAL_BATCH_DELAY
+            )
+        return approval_batchers[tenant_name]
+
+
+def approval_callback(update: Update, context: CallbackContext) -> None:
+    """Handles an Approve/Reject button press."""
+    query = update.callback_query
+    if not is_admin(update):
+        query.answer("Only the finance team can approve claims.", show_alert=True)
+        return
+
+    _, decision, claim_id, version = query.data.split(":")
+    status = DECISIONS[decision]
+
+    if not set_approval(claim_id, status, int(version)):
+        # Someone else decided first, show them what the claim is now
+        current = get_approval(claim_id)
+        query.answer(f"This claim was already updated to {current['status']}.")
+        try:
+            query.edit_message_reply_markup(
+                reply_markup=get_approval_keyboard(claim_id, current["version"])
+            )
+        except BadRequest as err:
+            # The winner usually updated this very message already
+            if "not modified" not in str(err).lower():
+                raise
+        return
+
+    get_approval_batcher().add(claim_id, status, context.job_queue)
+    query.answer(f"Claim {status.lower()}.")
+
+    text = query.message.text_markdown.rsplit("*Status*:", 1)[0]
+    decided_by = escape_markdown(query.from_user.first_name)
+    query.edit_message_text(
+        text=f"{text}*Status*: {status} (by {decided_by})",
+        reply_markup=get_approval_keyboard(claim_id, int(version) + 1),
+        parse_mode="Markdown",
+    )
+
+
+def pending_command(update: Update, context: CallbackContext) -> None:
+    """
+    Admin command that posts the oldest pending claims to the approval chat.
+    Usage: /pending
+    """
+    if not is_admin(update):
+        notify_not_authorised(update)
+        return
+
+    if get_approval_chat_id() is None:
+        update.message.reply_text("⚠️ No approval chat is set up for this trip.")
+        return
+
+    posted = 0
+    row_number = 2  # row 1 is the header
+    positions = []
+    for _, rows in fetch_sheet_pages(PENDING_LIMIT * 10):
+        for row in rows:
+            if row[0]:
+                positions.append((row[0], row_number))
+            if row[0] and row[APPROVAL_STATUS_COLUMN].lower() == "pending":
+                post_claim_for_approval(context.bot, row)
+                posted += 1
+            row_number += 1
+            if posted >= PENDING_LIMIT:
+                break
+        if posted >= PENDING_LIMIT:
+            break
+
+    # Cache the row positions read along the way for the status writes
+    record_sheet_claims(positions)
+    update.message.reply_text(f"📬 Posted {posted} pending claims for approval.")
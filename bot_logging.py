@@ -0,0 +1,121 @@
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from drive_connector import config
+
+LOG_PATH = config["logging"]["path"]
+LOG_MAX_BYTES = config["logging"]["max_bytes"]
+LOG_BACKUP_COUNT = config["logging"]["backup_count"]
+ERROR_WINDOW_SECONDS = config["logging"]["error_window_seconds"]
+
+CONSOLE_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+listener = None
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats each record as one compact JSON line, including any `fields` passed via `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["traceback"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TracebackQueueHandler(QueueHandler):
+    """
+    QueueHandler.prepare folds the traceback into the message. This keeps it
+    in exc_text instead, so the listener's formatters each decide where it goes.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # Tracebacks hold references to every frame, so do not keep them queued
+        record.exc_info = None
+        return record
+
+
+def setup_logging(level: int = logging.INFO) -> None:
+    """
+    Configures logging for the whole bot. Handler threads only put records on a
+    queue; a background listener thread formats them and writes them to the
+    console and to a size-rotated JSON log file.
+    """
+    global listener
+    if listener is not None:
+        return
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    log_directory = os.path.dirname(LOG_PATH)
+    if log_directory:
+        os.makedirs(log_directory, exist_ok=True)
+    file_handler = RotatingFileHandler(
+        LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT
+    )
+    file_handler.setFormatter(StructuredFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [TracebackQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, console_handler, file_handler)
+    listener.start()
+    # Flush whatever is still queued when the bot shuts down
+    atexit.register(listener.stop)
+
+
+class DuplicateSuppressor:
+    """
+    Lets the first occurrence of a key through and suppresses repeats of it
+    within `window` seconds, counting how many were suppressed.
+    """
+
+    def __init__(self, window: float = ERROR_WINDOW_SECONDS):
+        self.window = window
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> (window start, suppressed count)
+
+    def allow(self, key):
+        """
+        Returns None if the key should be suppressed, otherwise the number of
+        repeats suppressed since the key was last let through.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if len(self.entries) > 1000:
+                # Forget expired keys so the table does not grow forever
+                self.entries = {
+                    k: v for k, v in self.entries.items() if now - v[0] < self.window
+                }
+
+            started, suppressed = self.entries.get(key, (None, 0))
+            if started is not None and now - started < self.window:
+                self.entries[key] = (started, suppressed + 1)
+                return None
+
+            self.entries[key] = (now, 0)
+            return suppressed
@@ -0,0 +1,129 @@
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceUnavailableError(Exception):
+    """Raised when a Google backend is down, timing out or its circuit is open."""
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """Raised without calling the backend while its circuit breaker is tripped."""
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one backend. The breaker trips (opens) after too many
+    consecutive failures, or when the error rate over the last `window_size`
+    calls passes `error_rate_threshold`. While open, calls fail fast with
+    CircuitOpenError. After `reset_timeout` seconds a single half-open probe
+    call is let through: success closes the breaker, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        is_failure,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        window_size: int = 20,
+        reset_timeout: float = 30,
+    ):
+        self.name = name
+        self.is_failure = is_failure
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.window_size = window_size
+        self.reset_timeout = reset_timeout
+
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.outcomes = deque(maxlen=window_size)
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    @property
+    def available(self) -> bool:
+        """True if the backend is believed to be healthy."""
+        return self.state == self.CLOSED
+
+    def allow_request(self) -> bool:
+        """Decides whether a call may go through, moving open -> half-open once the timeout has passed."""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                logger.info("Circuit '%s' is half-open, probing the backend", self.name)
+            # Only one probe at a time while half-open
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.probe_in_flight = False
+            self.consecutive_failures = 0
+            self.outcomes.append(True)
+            if self.state != self.CLOSED:
+                logger.info("Circuit '%s' closed, backend recovered", self.name)
+                self.state = self.CLOSED
+                self.outcomes.clear()
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.probe_in_flight = False
+            self.consecutive_failures += 1
+            self.outcomes.append(False)
+
+            failures = self.outcomes.count(False)
+            error_rate_exceeded = (
+                len(self.outcomes) == self.window_size
+                and failures / self.window_size >= self.error_rate_threshold
+            )
+            if (
+                self.state == self.HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+                or error_rate_exceeded
+            ):
+                if self.state != self.OPEN:
+                    logger.warning("Circuit '%s' tripped, failing fast", self.name)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func through the breaker. Backend failures (as decided by
+        is_failure) are re-raised as ServiceUnavailableError, any other
+        exception is passed through untouched. Only wrap calls that actually
+        reach the backend, as a half-open call is the probe that decides
+        whether the circuit closes again.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable")
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as err:
+            if self.is_failure(err):
+                self.record_failure()
+                raise ServiceUnavailableError(
+                    f"{self.name} call failed: {err}"
+                ) from err
+            # The backend answered, so it is healthy even if the request was bad
+            self.record_success()
+            raise
+
+        self.record_success()
+        return result
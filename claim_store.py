@@ -0,0 +1,317 @@
+import sys
+import json
+import sqlite3
+import logging
+import threading
+
+from bot_logging import setup_logging
+from drive_connector import (
+    RECEIPT_DETAILS_COLUMN,
+    SAMPLE_RANGE_NAME,
+    add_claim_listener,
+    add_upload_listener,
+    batch_get_ranges,
+    batch_update_ranges,
+    config,
+    list_folder_files,
+    receipt_details,
+    tenant_registry,
+)
+from tenants import get_current_tenant, tenant_context
+
+logger = logging.getLogger(__name__)
+
+CLAIM_STORE_PATH = config["claim_store"]["path"]
+SHEET_UPDATE_BATCH_SIZE = 500
+
+store_lock = threading.Lock()
+
+
+def connect() -> sqlite3.Connection:
+    """Opens the current tenant's claim store, creating the tables on first use."""
+    connection = sqlite3.connect(get_current_tenant().path(CLAIM_STORE_PATH))
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS receipts (
+            claim_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            size INTEGER,
+            md5 TEXT
+        )
+        """
+    )
+    # Every claim row the bot has built, and the sheet row it lives in once appended
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS claims (
+            claim_id TEXT PRIMARY KEY,
+            row_number INTEGER,
+            row TEXT
+        )
+        """
+    )
+    # Approval status of each claim, versioned so concurrent decisions can be detected
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS approvals (
+            claim_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            version INTEGER NOT NULL
+        )
+        """
+    )
+    # Receipts listed in the Drive claim receipt folder by the reconciliation job
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS drive_files (
+            claim_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_time TEXT
+        )
+        """
+    )
+    return connection
+
+
+def normalise_claim_id(claim_id: str) -> str:
+    """Claim IDs are capitalised in the sheet but lowercase in Drive, so compare them in lowercase."""
+    return claim_id.strip().lower()
+
+
+def record_receipts(receipts: list[tuple]) -> None:
+    """Saves (claim ID, file ID, size, md5) tuples, replacing any existing entry for the claim."""
+    rows = [
+        (normalise_claim_id(claim_id), file_id, int(size) if size else None, md5)
+        for claim_id, file_id, size, md5 in receipts
+    ]
+    with store_lock:
+        connection = connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO receipts VALUES (?, ?, ?, ?)", rows
+            )
+        connection.close()
+
+
+def record_uploaded_receipt(receipt_name: str, receipt_file: dict) -> None:
+    """Upload listener that saves the Drive details of every new receipt."""
+    record_receipts(
+        [
+            (
+                receipt_name,
+                receipt_file["id"],
+                receipt_file.get("size"),
+                receipt_file.get("md5Checksum"),
+            )
+        ]
+    )
+
+
+def get_receipt(claim_id: str):
+    """Returns the Drive details of the claim's receipt, or None if it is not in the store."""
+    with store_lock:
+        connection = connect()
+        row = connection.execute(
+            "SELECT file_id, size, md5 FROM receipts WHERE claim_id = ?",
+            (normalise_claim_id(claim_id),),
+        ).fetchone()
+        connection.close()
+
+    if row is None:
+        return None
+    return {"id": row[0], "size": row[1], "md5Checksum": row[2]}
+
+
+def journal_claim_row(new_row: list[str]) -> None:
+    """Saves a claim row locally before it is appended, so it can be re-appended if the append is lost."""
+    with store_lock:
+        connection = connect()
+        with connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO claims (claim_id, row) VALUES (?, ?)",
+                (normalise_claim_id(new_row[0]), json.dumps(new_row)),
+            )
+        connection.close()
+
+
+def record_claim_row(new_row: list[str], row_number: int) -> None:
+    """Claim listener that saves each appended row together with its sheet row number."""
+    with store_lock:
+        connection = connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO claims (claim_id, row_number, row) VALUES (?, ?, ?)",
+                (normalise_claim_id(new_row[0]), row_number, json.dumps(new_row)),
+            )
+        connection.close()
+
+
+def record_sheet_claims(claims: list[tuple]) -> None:
+    """Saves the sheet row number of each (claim ID, row number), keeping any journaled row."""
+    rows = [
+        (normalise_claim_id(claim_id), row_number) for claim_id, row_number in claims
+    ]
+    with store_lock:
+        connection = connect()
+        with connection:
+            connection.executemany(
+                """
+                INSERT INTO claims (claim_id, row_number) VALUES (?, ?)
+                ON CONFLICT (claim_id) DO UPDATE SET row_number = excluded.row_number
+                """,
+                rows,
+            )
+        connection.close()
+
+
+def get_journaled_row(claim_id: str):
+    """Returns the journaled sheet row for a claim, or None if the bot never built one."""
+    with store_lock:
+        connection = connect()
+        result = connection.execute(
+            "SELECT row FROM claims WHERE claim_id = ?", (normalise_claim_id(claim_id),)
+        ).fetchone()
+        connection.close()
+
+    if result is None or result[0] is None:
+        return None
+    return json.loads(result[0])
+
+
+def get_row_number(claim_id: str):
+    """Returns the cached sheet row number of a claim, or None if it is not known."""
+    with store_lock:
+        connection = connect()
+        result = connection.execute(
+            "SELECT row_number FROM claims WHERE claim_id = ?",
+            (normalise_claim_id(claim_id),),
+        ).fetchone()
+        connection.close()
+    return result[0] if result else None
+
+
+def get_approval(claim_id: str, status: str = "Pending") -> dict:
+    """
+    Returns the claim's approval status and version, starting it at version 0
+    with the given status if the claim has not been seen before.
+    """
+    claim_id = normalise_claim_id(claim_id)
+    with store_lock:
+        connection = connect()
+        with connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO approvals VALUES (?, ?, 0)", (claim_id, status)
+            )
+            result = connection.execute(
+                "SELECT status, version FROM approvals WHERE claim_id = ?", (claim_id,)
+            ).fetchone()
+        connection.close()
+    return {"status": result[0], "version": result[1]}
+
+
+def set_approval(claim_id: str, status: str, expected_version: int) -> bool:
+    """
+    Sets the claim's approval status if its version is still expected_version,
+    bumping the version. Returns False if someone else changed it first.
+    """
+    with store_lock:
+        connection = connect()
+        with connection:
+            cursor = connection.execute(
+                """
+                UPDATE approvals SET status = ?, version = version + 1
+                WHERE claim_id = ? AND version = ?
+                """,
+                (status, normalise_claim_id(claim_id), expected_version),
+            )
+        connection.close()
+    return cursor.rowcount == 1
+
+
+def get_all_receipts() -> dict:
+    """Returns every stored receipt keyed by normalised claim ID."""
+    with store_lock:
+        connection = connect()
+        rows = connection.execute(
+            "SELECT claim_id, file_id, size, md5 FROM receipts"
+        ).fetchall()
+        connection.close()
+    return {
+        claim_id: {"id": file_id, "size": size, "md5Checksum": md5}
+        for claim_id, file_id, size, md5 in rows
+    }
+
+
+# Index every receipt as it is uploaded, and every claim row as it is appended
+add_upload_listener(record_uploaded_receipt)
+add_claim_listener(record_claim_row)
+
+
+def backfill_receipts() -> int:
+    """
+    One-time job that pages through the current tenant's receipt folders, storing
+    the Drive details of every receipt, then fills in the receipt columns of any
+    sheet rows that are missing them. Returns the number of receipts indexed.
+    """
+    tenant = get_current_tenant()
+    indexed = 0
+    for folder_id in [tenant.claim_receipt_folder_id, tenant.payment_proof_folder_id]:
+        for files in list_folder_files(folder_id, fields="id, name, size, md5Checksum"):
+            record_receipts(
+                [
+                    (
+                        file["name"].rsplit(".", 1)[0],
+                        file["id"],
+                        file.get("size"),
+                        file.get("md5Checksum"),
+                    )
+                    for file in files
+                ]
+            )
+            indexed += len(files)
+            logger.info("Indexed %d receipts", indexed)
+
+    receipts = get_all_receipts()
+
+    # Only read the claim ID and receipt columns of the sheet
+    sheet_name, columns = SAMPLE_RANGE_NAME.split("!")
+    first_col = columns.split(":")[0]
+    details_start = chr(ord(first_col) + RECEIPT_DETAILS_COLUMN)
+    details_end = chr(ord(details_start) + 2)
+    claim_ids, details = batch_get_ranges(
+        [
+            f"{sheet_name}!{first_col}2:{first_col}",
+            f"{sheet_name}!{details_start}2:{details_end}",
+        ]
+    )
+
+    updates = []
+    for index, claim_id_cell in enumerate(claim_ids):
+        if not claim_id_cell:
+            continue
+        has_details = index < len(details) and details[index] and details[index][0]
+        receipt = receipts.get(normalise_claim_id(claim_id_cell[0]))
+        if receipt and not has_details:
+            row_number = index + 2
+            updates.append(
+                {
+                    "range": f"{sheet_name}!{details_start}{row_number}:{details_end}{row_number}",
+                    "values": [receipt_details(receipt)],
+                }
+            )
+
+    for start in range(0, len(updates), SHEET_UPDATE_BATCH_SIZE):
+        batch_update_ranges(updates[start : start + SHEET_UPDATE_BATCH_SIZE])
+    logger.info("Filled in receipt details for %d sheet rows", len(updates))
+
+    return indexed
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        setup_logging()
+        for tenant in tenant_registry.all():
+            with tenant_context(tenant):
+                backfill_receipts()
+    else:
+        print("Usage: python claim_store.py backfill")
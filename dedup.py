@@ -0,0 +1,125 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from telegram import Update
+from telegram.ext import CallbackContext, DispatcherHandlerStop
+
+from drive_connector import config
+
+logger = logging.getLogger(__name__)
+
+DEDUP_MAX_ENTRIES = config["dedup"]["max_entries"]
+DEDUP_PERSIST_PATH = config["dedup"]["persist_path"]
+
+
+class IdempotencyCache:
+    """
+    Bounded LRU of the updates and messages the bot has already processed,
+    together with the results of their side-effecting steps. It can be saved
+    to a JSON file so that redeliveries after a restart are recognised too.
+    """
+
+    def __init__(self, max_entries: int, persist_path: str = None):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.dirty = False
+
+    def mark_seen(self, key: str) -> bool:
+        """Records the key, returning True if it had already been seen."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return True
+            self.entries[key] = {}
+            self._trim()
+            return False
+
+    def get(self, key: str) -> dict:
+        """Returns the results recorded for the key (empty if none)."""
+        with self.lock:
+            return dict(self.entries.get(key, {}))
+
+    def record(self, key: str, **results) -> None:
+        """Records the results of one or more completed steps for the key."""
+        with self.lock:
+            self.entries.setdefault(key, {}).update(results)
+            self.entries.move_to_end(key)
+            self._trim()
+
+    def _trim(self) -> None:
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def load(self) -> None:
+        """Loads the saved cache, if persistence is enabled and a file exists."""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        with open(self.persist_path, "r") as file:
+            saved = json.load(file)
+        with self.lock:
+            self.entries = OrderedDict(saved[-self.max_entries :])
+            self.dirty = False
+
+    def save(self) -> None:
+        """Saves the cache if persistence is enabled and it changed since the last save."""
+        if not self.persist_path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            saved = list(self.entries.items())
+            self.dirty = False
+
+        temp_path = f"{self.persist_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(saved, file)
+        os.replace(temp_path, self.persist_path)
+
+
+processed_updates = IdempotencyCache(DEDUP_MAX_ENTRIES, DEDUP_PERSIST_PATH)
+
+
+def get_message_key(update: Update, context: CallbackContext) -> str:
+    """Idempotency key for the side effects of a message: the same (bot, chat, message) is the same request."""
+    return (
+        f"message:{context.bot.id}:{update.effective_chat.id}:"
+        f"{update.effective_message.message_id}"
+    )
+
+
+def skip_duplicate_updates(update: Update, context: CallbackContext) -> None:
+    """
+    Runs before every other handler. A redelivered update is dropped once its
+    message has been fully processed, sending the original confirmation again
+    if there was one. A message that was only partly processed (e.g. the bot
+    crashed between the upload and the append) is let through, so its handler
+    can resume from the steps it recorded.
+    """
+    # Update IDs are only unique per bot, and one process can run several bots
+    duplicate = processed_updates.mark_seen(
+        f"update:{context.bot.id}:{update.update_id}"
+    )
+
+    if update.message is not None:
+        message_key = get_message_key(update, context)
+        duplicate = processed_updates.mark_seen(message_key) or duplicate
+        steps = processed_updates.get(message_key)
+        if duplicate and steps and not steps.get("completed"):
+            logger.info("Resuming partly processed update %s", update.update_id)
+            return
+        if duplicate and steps.get("confirmation"):
+            update.message.reply_text(steps["confirmation"], parse_mode="Markdown")
+
+    if duplicate:
+        logger.info("Skipping duplicate update %s", update.update_id)
+        raise DispatcherHandlerStop()
+
+
+def save_processed_updates(context: CallbackContext) -> None:
+    """Job that persists the deduplication cache."""
+    processed_updates.save()
@@ -1,24 +1,33 @@
 import os
 import io
+import re
+import logging
 import pandas as pd
+import threading
 from datetime import datetime
+from functools import partial
 from dotenv import load_dotenv
 import yaml
+import httplib2
+import httpx
 from telegram.ext import CallbackContext
 
+from google.auth.exceptions import TransportError
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+
+from circuit_breaker import CircuitBreaker
+from google_rest import DriveService, GoogleSession, SheetsService
+from tenants import Tenant, TenantRegistry, get_current_tenant, tenant_context
 
 load_dotenv()
-SAMPLE_SPREADSHEET_ID = os.environ["SAMPLE_SPREADSHEET_ID"]
-CLAIM_RECEIPT_FOLDER_ID = os.environ["CLAIM_RECEIPT_FOLDER_ID"]
-PAYMENT_PROOF_FOLDER_ID = os.environ["PAYMENT_PROOF_FOLDER_ID"]
+
+logger = logging.getLogger(__name__)
 
 
 # Load in config file
@@ -37,19 +46,90 @@ SAMPLE_RANGE_NAME = config["sheets"]["range_name"]
 CREDENTIALS_PATH = config["credentials"]["path"]
 SHEET_TOKEN_PATH = config["sheets"]["token_path"]
 DRIVE_TOKEN_PATH = config["drive"]["token_path"]
+GOOGLE_TIMEOUT = config["circuit_breaker"]["timeout"]
+GOOGLE_TRANSPORT = config["google"]["transport"]
 
+# Trips served by this process. The spreadsheet and folders used by every
+# function below are those of the tenant current on the calling thread.
+tenant_registry = TenantRegistry(config["tenants"]["path"])
 
-def fetch_sheet():
+
+def get_admin_ids(tenant: Tenant) -> list[int]:
+    """Returns the finance team admins of a trip: the global admins plus the trip's own."""
+    return (config.get("admin", {}).get("user_ids") or []) + tenant.admin_user_ids
+
+
+def is_backend_failure(err: Exception) -> bool:
     """
-    Fetches data from the excel sheet and stores returns it as a pandas dataframe
+    Decides whether an exception means the Google backend itself is unhealthy
+    (timeouts, connection errors, 429 and 5xx responses) rather than the request being bad.
     """
+    if isinstance(err, HttpError):
+        return err.resp.status == 429 or err.resp.status >= 500
+    # socket.timeout and connection errors are both OSErrors
+    return isinstance(
+        err, (OSError, httplib2.HttpLib2Error, httpx.TransportError, TransportError)
+    )
+
+
+breaker_settings = {
+    key: value
+    for key, value in config["circuit_breaker"].items()
+    if key not in ["timeout", "probe_interval"]
+}
+# Only calls that reach Google (request.execute) go through a breaker. Building a
+# client is local, and a half-open probe must be a real request to be meaningful.
+sheets_breaker = CircuitBreaker("Google Sheets", is_backend_failure, **breaker_settings)
+drive_breaker = CircuitBreaker("Google Drive", is_backend_failure, **breaker_settings)
+
+# Last sheet fetched successfully per tenant, used to answer status checks while Sheets is down
+sheet_snapshots = {}  # tenant name -> (data, fetched_at)
+sheet_snapshot_lock = threading.Lock()
+
+# Position of the receipt's Drive file ID, size and MD5 hash columns in a claim row
+RECEIPT_DETAILS_COLUMN = 9
+
+# Functions called with every row successfully appended to the sheet
+claim_listeners = []
+
+# Functions called with the name and Drive details of every uploaded receipt
+upload_listeners = []
+
+
+def add_claim_listener(listener) -> None:
+    """Registers a function to be called with (row, row number) after each claim is appended."""
+    claim_listeners.append(listener)
 
+
+def add_upload_listener(listener) -> None:
+    """Registers a function to be called with (receipt name, file details) after each upload."""
+    upload_listeners.append(listener)
+
+
+def notify_listeners(listeners: list, *args) -> None:
+    """
+    Calls each listener with the arguments. The Google call they follow has
+    already succeeded, so a failing listener is logged instead of raised, and
+    never makes the caller repeat that call.
+    """
+    for listener in listeners:
+        try:
+            listener(*args)
+        except Exception:
+            logger.exception(
+                "Listener %s failed", getattr(listener, "__name__", listener)
+            )
+
+
+def get_credentials(token_path: str, scopes: list[str]) -> Credentials:
+    """
+    Loads the cached OAuth credentials, refreshing or logging in again if needed
+    """
     creds = None
 
-    # Check if token.json exists and load it if it does
-    # Need better error handling for this
-    if os.path.exists(SHEET_TOKEN_PATH):
-        creds = Credentials.from_authorized_user_file(SHEET_TOKEN_PATH, SHEETS_SCOPES)
+    # Check if the token file exists and load it if it does
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, scopes)
 
     # If no valid credentials are available, log in again
     if not creds or not creds.valid:
@@ -57,205 +137,348 @@ def fetch_sheet():
             creds.refresh(Request())  # refresh the token if it’s expired
         else:
             # log in and get new credentials
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_PATH, SHEETS_SCOPES
-            )
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_PATH, scopes)
             creds = flow.run_local_server(port=0)
 
         # Save the credentials for future runs
-        with open(SHEET_TOKEN_PATH, "w") as token:
+        with open(token_path, "w") as token:
             token.write(creds.to_json())
 
-    try:
-        # Call the Sheets API
-        service = build("sheets", "v4", credentials=creds)
-        sheet = service.spreadsheets()
-        result = (
-            sheet.values()
-            .get(spreadsheetId=SAMPLE_SPREADSHEET_ID, range=SAMPLE_RANGE_NAME)
-            .execute()
-        )
-        # retrieve the sheet data
-        sheet = result.get("values", [])
-        # check if there's data in the sheet
-        if not sheet:
-            return "No data found in the Google Sheet."
+    return creds
+
+
+def create_rest_session(token_path: str, scopes: list[str]) -> GoogleSession:
+    """Opens a pooled keep-alive session to the Google APIs, shared by every thread."""
+    return GoogleSession(
+        partial(get_credentials, token_path, scopes),
+        timeout=GOOGLE_TIMEOUT,
+        connect_timeout=config["google"]["connect_timeout"],
+        max_connections=config["google"]["max_connections"],
+        http2=config["google"]["http2"],
+    )
 
-        # Here the sheet is a pandas dataframe
-        df = pd.DataFrame(sheet[1:], columns=sheet[0])
-        return df
 
-    except HttpError as err:
-        return f"An error occurred: {err}"
+if GOOGLE_TRANSPORT == "rest":
+    sheets_session = create_rest_session(SHEET_TOKEN_PATH, SHEETS_SCOPES)
+    drive_session = create_rest_session(DRIVE_TOKEN_PATH, G_DRIVE_SCOPES)
+
+
+def get_sheets_service():
+    """Builds a Google Sheets API client."""
+    if GOOGLE_TRANSPORT == "rest":
+        return SheetsService(sheets_session)
+
+    creds = get_credentials(SHEET_TOKEN_PATH, SHEETS_SCOPES)
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GOOGLE_TIMEOUT))
+    return build("sheets", "v4", http=http)
+
+
+def get_drive_service():
+    """Builds a Google Drive API client."""
+    if GOOGLE_TRANSPORT == "rest":
+        return DriveService(drive_session)
+
+    creds = get_credentials(DRIVE_TOKEN_PATH, G_DRIVE_SCOPES)
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GOOGLE_TIMEOUT))
+    return build("drive", "v3", http=http)
+
+
+def fetch_sheet():
+    """
+    Fetches data from the excel sheet and stores returns it as a pandas dataframe.
+    Raises ServiceUnavailableError if Google Sheets is down or its circuit is open.
+    """
+    # Call the Sheets API
+    service = get_sheets_service()
+    sheet = service.spreadsheets()
+    request = sheet.values().get(
+        spreadsheetId=get_current_tenant().spreadsheet_id, range=SAMPLE_RANGE_NAME
+    )
+    result = sheets_breaker.call(request.execute)
+
+    # retrieve the sheet data
+    sheet = result.get("values", [])
+    # check if there's data in the sheet
+    if not sheet:
+        df = pd.DataFrame()
+    else:
+        # Rows can be wider than the header (e.g. the receipt columns J-L on sheets
+        # whose header predates them) or shorter (trailing blank cells), so fit
+        # every row to the header
+        header = sheet[0]
+        width = len(header)
+        rows = [row[:width] + [""] * (width - len(row)) for row in sheet[1:]]
+        df = pd.DataFrame(rows, columns=header)
+
+    with sheet_snapshot_lock:
+        sheet_snapshots[get_current_tenant().name] = (df, datetime.now())
+    return df
+
+
+def forget_sheet_snapshot(tenant_name: str) -> None:
+    """Drops the snapshot of a tenant whose spreadsheet changed or that was removed."""
+    with sheet_snapshot_lock:
+        sheet_snapshots.pop(tenant_name, None)
+
+
+tenant_registry.add_reload_listener(forget_sheet_snapshot)
+
+
+def get_sheet_snapshot():
+    """Returns the last successfully fetched sheet and when it was fetched (None, None if never)."""
+    with sheet_snapshot_lock:
+        return sheet_snapshots.get(get_current_tenant().name, (None, None))
+
+
+def fetch_sheet_pages(page_size: int):
+    """
+    Reads the sheet in row-range pages so that callers never hold more than
+    one page in memory. Yields (header, rows) tuples, with every row padded
+    to the width of the header. A sheet with a header but no rows yields one
+    empty page.
+    """
+    sheet_name, columns = SAMPLE_RANGE_NAME.split("!")
+    first_col, last_col = columns.split(":")
+    spreadsheet_id = get_current_tenant().spreadsheet_id
+
+    service = get_sheets_service()
+    values = service.spreadsheets().values()
+
+    header_range = f"{sheet_name}!{first_col}1:{last_col}1"
+    request = values.get(spreadsheetId=spreadsheet_id, range=header_range)
+    header = sheets_breaker.call(request.execute).get("values", [[]])[0]
+    if not header:
+        return
+
+    start_row = 2
+    while True:
+        end_row = start_row + page_size - 1
+        page_range = f"{sheet_name}!{first_col}{start_row}:{last_col}{end_row}"
+        request = values.get(spreadsheetId=spreadsheet_id, range=page_range)
+        rows = sheets_breaker.call(request.execute).get("values", [])
+        if not rows:
+            # Still yield the header of a sheet with no claims, so exports get their columns
+            if start_row == 2:
+                yield header, []
+            return
+
+        width = len(header)
+        yield header, [row[:width] + [""] * (width - len(row)) for row in rows]
+
+        # A short page means we have reached the end of the sheet
+        if len(rows) < page_size:
+            return
+        start_row = end_row + 1
 
 
 def get_claim_status(df, id):
     id = id.strip()
     try:
         status_msg = df[df["Claim ID"] == id]["Approval Status"].values[0]
-    except IndexError:
+    except (IndexError, KeyError):
         return {"error": True, "status_msg": id}
 
     return {"error": False, "status_msg": status_msg}
 
 
-def send_claim_receipt_to_cloud(receipt_path: str, photo_file) -> str:
-    """Uploads the receipt to a pre-defined folder in Google Drive and returns the file ID."""
+def batch_get_ranges(ranges: list[str]) -> list[list[list[str]]]:
+    """Reads several ranges of the sheet in one request and returns the values of each."""
+    service = get_sheets_service()
+    request = (
+        service.spreadsheets()
+        .values()
+        .batchGet(spreadsheetId=get_current_tenant().spreadsheet_id, ranges=ranges)
+    )
+    result = sheets_breaker.call(request.execute)
+    return [value_range.get("values", []) for value_range in result["valueRanges"]]
+
+
+def batch_update_ranges(data: list[dict]) -> None:
+    """Writes several {"range": ..., "values": ...} blocks to the sheet in one request."""
+    service = get_sheets_service()
+    request = (
+        service.spreadsheets()
+        .values()
+        .batchUpdate(
+            spreadsheetId=get_current_tenant().spreadsheet_id,
+            body={"valueInputOption": "RAW", "data": data},
+        )
+    )
+    sheets_breaker.call(request.execute)
 
-    creds = None
 
-    if os.path.exists(DRIVE_TOKEN_PATH):
-        creds = Credentials.from_authorized_user_file(DRIVE_TOKEN_PATH, G_DRIVE_SCOPES)
+def upload_receipt(receipt_name: str, receipt_bytes: bytes, folder_id: str) -> dict:
+    """
+    Uploads the JPG receipt bytes to the given Google Drive folder and returns
+    the new file's id, size and md5Checksum.
+    """
+    # calling the google drive API
+    service = get_drive_service()
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())  # refresh the token if it’s expired
-        else:
-            # Log in and get new credentials
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_PATH, G_DRIVE_SCOPES
-            )
-            creds = flow.run_local_server(port=0)
+    file_metadata = {
+        "name": f"{receipt_name}.jpg",
+        "parents": [folder_id],
+    }
+    media = MediaIoBaseUpload(io.BytesIO(receipt_bytes), mimetype="image/jpeg")
 
-        with open(DRIVE_TOKEN_PATH, "w") as token:
-            token.write(creds.to_json())
+    # Upload the file to Google Drive inside the folder with FOLDER_ID
+    request = service.files().create(
+        body=file_metadata, media_body=media, fields="id, size, md5Checksum"
+    )
+    receipt_file = drive_breaker.call(request.execute)
 
-    # calling the google drive API
-    service = build("drive", "v3", credentials=creds)
-
-    # Validate the MIME type to ensure it's a JPG
-    if photo_file.file_path.endswith(".jpg") or photo_file.file_path.endswith(".jpeg"):
-        # Use a unique file name for the receipt using the UUID
-        image_uuid = receipt_path
-        file_metadata = {
-            "name": f"{image_uuid}.jpg",
-            "parents": [CLAIM_RECEIPT_FOLDER_ID],
-        }
-
-        # store media bytes
-        receipt_stream = io.BytesIO(photo_file.download_as_bytearray())
-        media = MediaIoBaseUpload(receipt_stream, mimetype="image/jpeg")
-
-        # Upload the file to Google Drive inside the folder with FOLDER_ID
-        file = (
-            service.files()
-            .create(body=file_metadata, media_body=media, fields="id")
-            .execute()
+    notify_listeners(upload_listeners, receipt_name, receipt_file)
+    return receipt_file
+
+
+def list_folder_files(
+    folder_id: str, fields: str = "id, name", page_size: int = 1000, query: str = None
+):
+    """
+    Yields the files in a Drive folder one page at a time, requesting only the
+    given fields. An extra Drive search query can narrow the listing down.
+    """
+    service = get_drive_service()
+    search = f"'{folder_id}' in parents and trashed = false"
+    if query:
+        search = f"{search} and {query}"
+
+    page_token = None
+    while True:
+        request = service.files().list(
+            q=search,
+            fields=f"nextPageToken, files({fields})",
+            pageSize=page_size,
+            pageToken=page_token,
         )
-        return
+        result = drive_breaker.call(request.execute)
+        yield result.get("files", [])
 
-    else:
-        raise ValueError("File type is not JPG")
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return
 
 
-def send_payment_proof_to_cloud(receipt_path: str, photo_file) -> str:
-    """Uploads the receipt to a pre-defined folder in Google Drive and returns the file ID."""
+def download_receipt(file_id: str) -> bytes:
+    """Downloads a receipt from Google Drive by its file ID."""
+    service = get_drive_service()
+    # Receipts are small photos, so they are fetched in one request
+    request = service.files().get_media(fileId=file_id)
+    return drive_breaker.call(request.execute)
 
-    creds = None
 
-    if os.path.exists(DRIVE_TOKEN_PATH):
-        creds = Credentials.from_authorized_user_file(DRIVE_TOKEN_PATH, G_DRIVE_SCOPES)
+def ping_drive() -> None:
+    """Makes the cheapest possible Drive call, used to probe whether Drive has recovered."""
+    service = get_drive_service()
+    request = service.files().list(pageSize=1, fields="files(id)")
+    drive_breaker.call(request.execute)
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())  # refresh the token if it’s expired
-        else:
-            # Log in and get new credentials
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_PATH, G_DRIVE_SCOPES
-            )
-            creds = flow.run_local_server(port=0)
 
-        with open(DRIVE_TOKEN_PATH, "w") as token:
-            token.write(creds.to_json())
+def is_jpg(photo_file) -> bool:
+    """Validates the file extension to ensure it's a JPG."""
+    return photo_file.file_path.endswith((".jpg", ".jpeg"))
 
-    # calling the google drive API
-    service = build("drive", "v3", credentials=creds)
-
-    # Validate the MIME type to ensure it's a JPG
-    if photo_file.file_path.endswith(".jpg") or photo_file.file_path.endswith(".jpeg"):
-        # Use a unique file name for the receipt using the UUID
-        image_uuid = receipt_path
-        file_metadata = {
-            "name": f"{image_uuid}.jpg",
-            "parents": [PAYMENT_PROOF_FOLDER_ID],
-        }
-
-        # store media bytes
-        receipt_stream = io.BytesIO(photo_file.download_as_bytearray())
-        media = MediaIoBaseUpload(receipt_stream, mimetype="image/jpeg")
-
-        # Upload the file to Google Drive inside the folder with FOLDER_ID
-        file = (
-            service.files()
-            .create(body=file_metadata, media_body=media, fields="id")
-            .execute()
-        )
-        return
 
-    else:
+def send_claim_receipt_to_cloud(receipt_path: str, photo_file) -> dict:
+    """Uploads the receipt to a pre-defined folder in Google Drive and returns the file details."""
+    if not is_jpg(photo_file):
         raise ValueError("File type is not JPG")
 
+    # Use a unique file name for the receipt using the UUID
+    return upload_receipt(
+        receipt_path,
+        photo_file.download_as_bytearray(),
+        get_current_tenant().claim_receipt_folder_id,
+    )
+
+
+def send_payment_proof_to_cloud(receipt_path: str, photo_file) -> dict:
+    """Uploads the receipt to a pre-defined folder in Google Drive and returns the file details."""
+    if not is_jpg(photo_file):
+        raise ValueError("File type is not JPG")
+
+    # Use a unique file name for the receipt using the UUID
+    return upload_receipt(
+        receipt_path,
+        photo_file.download_as_bytearray(),
+        get_current_tenant().payment_proof_folder_id,
+    )
+
 
 def current_datetime():
     return datetime.now().strftime("%Y-%m-%d")
 
 
-def export_claim_details(context: CallbackContext):
+def receipt_details(receipt_file: dict = None) -> list[str]:
+    """Returns the Drive file ID, size and MD5 hash of an uploaded receipt as sheet cells."""
+    if not receipt_file:
+        return ["", "", ""]
+    return [
+        receipt_file.get("id", ""),
+        str(receipt_file.get("size", "")),
+        receipt_file.get("md5Checksum", ""),
+    ]
+
+
+def build_claim_row(user_data: dict, receipt_file: dict = None) -> list[str]:
     """
-    Appends a new claim to the Google Sheet.
+    Builds the sheet row for a claim from the details collected in the conversation,
+    followed by the Drive details of the uploaded receipt (blank if not uploaded yet).
     """
-    new_row = [
-        context.user_data.get("receipt_uuid", "").capitalize(),
-        context.user_data.get("department", "").capitalize(),
-        context.user_data.get("name", "").capitalize(),
+    return [
+        user_data.get("receipt_uuid", "").capitalize(),
+        user_data.get("department", "").capitalize(),
+        user_data.get("name", "").capitalize(),
         current_datetime(),
-        context.user_data.get("category", "").capitalize(),
-        context.user_data.get("amount", "").capitalize(),
-        context.user_data.get("description", "").capitalize(),
+        user_data.get("category", "").capitalize(),
+        user_data.get("amount", "").capitalize(),
+        user_data.get("description", "").capitalize(),
         "Pending",
         "Yes",
-    ]
+    ] + receipt_details(receipt_file)
 
-    creds = None
 
-    if os.path.exists(SHEET_TOKEN_PATH):
-        creds = Credentials.from_authorized_user_file(SHEET_TOKEN_PATH, SHEETS_SCOPES)
+def get_row_number(updated_range: str) -> int:
+    """Extracts the row number from an A1 range such as 'Sheet1!A15:L15'."""
+    return int(re.search(r"(\d+)", updated_range.split("!")[-1]).group(1))
 
-    # If no valid credentials are available, log in again
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())  # refresh the token if it’s expired
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_PATH, SHEETS_SCOPES
-            )
-            creds = flow.run_local_server(port=0)
 
-        with open(SHEET_TOKEN_PATH, "w") as token:
-            token.write(creds.to_json())
+def append_claim_row(new_row: list[str]) -> int:
+    """
+    Appends a claim row to the Google Sheet and returns its row number.
+    Raises ServiceUnavailableError if Google Sheets is down or its circuit is open,
+    and HttpError if the append was rejected.
+    """
+    # Call the oogle sheets API
+    service = get_sheets_service()
+    sheet = service.spreadsheets()
 
-    try:
-        # Call the oogle sheets API
-        service = build("sheets", "v4", credentials=creds)
-        sheet = service.spreadsheets()
-
-        # appending the new row
-        request = sheet.values().append(
-            spreadsheetId=SAMPLE_SPREADSHEET_ID,
-            range=SAMPLE_RANGE_NAME,
-            valueInputOption="RAW",
-            insertDataOption="INSERT_ROWS",
-            body={"values": [new_row]},
-        )
-        response = request.execute()
+    # appending the new row
+    request = sheet.values().append(
+        spreadsheetId=get_current_tenant().spreadsheet_id,
+        range=SAMPLE_RANGE_NAME,
+        valueInputOption="RAW",
+        insertDataOption="INSERT_ROWS",
+        body={"values": [new_row]},
+    )
+    response = sheets_breaker.call(request.execute)
 
-        print(f"Claim successfully appended to Sheet ID {response['spreadsheetId']}")
+    logger.info("Claim successfully appended to Sheet ID %s", response["spreadsheetId"])
 
-    except HttpError as err:
-        print(f"An error occurred: {err}")
-        return
+    row_number = get_row_number(response["updates"]["updatedRange"])
+    notify_listeners(claim_listeners, new_row, row_number)
+    return row_number
+
+
+def export_claim_details(context: CallbackContext):
+    """
+    Appends a new claim to the Google Sheet.
+    """
+    append_claim_row(
+        build_claim_row(context.user_data, context.user_data.get("receipt_file"))
+    )
 
 
 if __name__ == "__main__":
-    fetch_sheet()
+    with tenant_context(tenant_registry.all()[0]):
+        fetch_sheet()
@@ -1,14 +1,21 @@
+import os
 import logging
-from datetime import datetime
+import traceback
+from datetime import datetime, timezone
 from telegram import Update
 from telegram.ext import CallbackContext
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+from bot_logging import DuplicateSuppressor
+
+from keyboards import get_main_menu_keyboard
 
 logger = logging.getLogger(__name__)
-from utils import get_main_menu_keyboard
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Repeated errors are only logged, and only replied to, once per chat per time window
+error_log_suppressor = DuplicateSuppressor()
+error_reply_suppressor = DuplicateSuppressor()
 
 
 def error_handler(update: Update, context: CallbackContext) -> None:
@@ -16,8 +23,14 @@ def error_handler(update: Update, context: CallbackContext) -> None:
     # Log the error with additional context
     log_error(update, context)
 
-    # Notify the user that an error occurred
-    update.message.reply_text(
+    message = update.effective_message if isinstance(update, Update) else None
+    if message is None:
+        return
+
+    # Notify the user that an error occurred, unless we just did
+    if error_reply_suppressor.allow(message.chat_id) is None:
+        return
+    message.reply_text(
         "An unexpected error occurred. Please try again. \
         If the issue persists, please contact me `@jer_jerryyy`",
         # Please add ur tele handles here so people can contact us
@@ -25,20 +38,50 @@ def error_handler(update: Update, context: CallbackContext) -> None:
     )
 
 
-def log_error(update: Update, context: CallbackContext) -> None:
-    """Logs errors with additional context for debugging."""
-    # Get information about the update and the error
-    error_message = f"Update '{update}' caused error '{context.error}'"
+def get_failing_handler(error: Exception) -> str:
+    """Returns the name of the innermost function in this project that the error passed through."""
+    handler = None
+    for frame in traceback.extract_tb(error.__traceback__):
+        if os.path.abspath(frame.filename).startswith(PROJECT_DIRECTORY):
+            handler = f"{os.path.basename(frame.filename)}:{frame.name}"
+    return handler
+
 
-    # Log the error (for now, we'll just print it, but this can be adapted to log to a file or external service)
-    print(error_message)
+def log_error(update: Update, context: CallbackContext) -> None:
+    """Logs errors as a compact structured record, suppressing repeats from the same chat."""
+    error = context.error
+    message = update.effective_message if isinstance(update, Update) else None
+    chat_id = message.chat_id if message else None
+
+    suppressed = error_log_suppressor.allow((chat_id, type(error).__name__))
+    if suppressed is None:
+        return
+
+    fields = {
+        "update_id": update.update_id if isinstance(update, Update) else None,
+        "chat_id": chat_id,
+        "handler": get_failing_handler(error),
+        "error_type": type(error).__name__,
+        "suppressed_repeats": suppressed,
+    }
+    if message is not None and message.date is not None:
+        # Time from the user sending the message to the error being handled
+        latency = datetime.now(timezone.utc) - message.date
+        fields["latency_ms"] = int(latency.total_seconds() * 1000)
+
+    logger.error(
+        "Update %s caused error: %s",
+        fields["update_id"],
+        error,
+        exc_info=error,
+        extra={"fields": fields},
+    )
 
 
 # external logging function for future extensibility
 def log_to_file(error_message: str) -> None:
-    """Writes the error message to a log file."""
-    with open("error_log.txt", "a") as log_file:
-        log_file.write(f"{datetime.now()}: {error_message}\n")
+    """Writes the error message to the rotating log file via the logging queue."""
+    logger.error(error_message)
 
 
 def handle_invalid_image(update: Update) -> None:
@@ -105,6 +148,38 @@ def notify_payment_feature_coming(update: Update) -> None:
     )
 
 
+def notify_not_authorised(update: Update) -> None:
+    """Notifies the user that the command is reserved for the finance team."""
+    update.message.reply_text(
+        "🔒 Sorry, this command is only available to the finance team.",
+        parse_mode="Markdown",
+    )
+
+
+def notify_submission_queued(update: Update) -> None:
+    """Notifies the user that Google is unavailable and their submission has been queued."""
+    update.message.reply_text(
+        "⏳ Google Drive/Sheets is currently unavailable, so your submission has been saved "
+        "and will be sent automatically once it is back. You will get a message when it is done!"
+    )
+
+
+def notify_claim_pending_reconciliation(update: Update) -> None:
+    """Notifies the user that their receipt was saved but the claim details still need to be recorded."""
+    update.message.reply_text(
+        "⚠️ Your receipt was saved, but we could not add your claim to the finance sheet just yet. "
+        "The finance team will add it for you, so there is no need to resubmit!"
+    )
+
+
+def notify_service_unavailable(update: Update) -> None:
+    """Notifies the user that the claim status cannot be checked right now."""
+    update.message.reply_text(
+        "⚠️ Sorry, we cannot reach Google Sheets right now. Please try checking your claim status again later.",
+        reply_markup=get_main_menu_keyboard(3, 2),
+    )
+
+
 def notify_invalid_option(update: Update) -> None:
     """Notifies the user that the input is not a valid option."""
     error_message = """*Oops! 😕 I didn’t quite get that.*
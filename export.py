@@ -0,0 +1,181 @@
+import os
+import csv
+import gzip
+import time
+import logging
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from drive_connector import config, fetch_sheet_pages
+from error_handling import notify_not_authorised
+from tenants import get_current_tenant
+from utils import is_admin
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports are optional
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_PAGE_SIZE = config["export"]["page_size"]
+EXPORT_DIRECTORY = config["export"]["directory"]
+
+AMOUNT_COLUMN = "Amount"
+DATE_COLUMN = "Date"
+
+# Amounts are exported as decimal(12, 2), so larger ones are written as null
+AMOUNT_PRECISION = 12
+AMOUNT_SCALE = 2
+MAX_PARQUET_AMOUNT = Decimal(10) ** (AMOUNT_PRECISION - AMOUNT_SCALE) - Decimal("0.01")
+
+
+def parse_amount(value: str):
+    """Converts a sheet amount such as '$12.50' into a Decimal, or None if it is blank/invalid."""
+    cleaned = value.replace("$", "").replace(",", "").strip()
+    if not cleaned:
+        return None
+    try:
+        amount = Decimal(cleaned).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+    # NaN cannot be compared or sorted, so treat it as invalid too
+    return amount if amount.is_finite() else None
+
+
+def parse_date(value: str):
+    """Converts a sheet date in YYYY-MM-DD format into a date, or None if it is blank/invalid."""
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def write_csv_export(pages, path: str) -> int:
+    """Streams the sheet pages into a gzip compressed CSV file and returns the row count."""
+    row_count = 0
+    with gzip.open(path, "wt", newline="", encoding="utf-8") as export_file:
+        writer = csv.writer(export_file)
+        for header, rows in pages:
+            if row_count == 0:
+                writer.writerow(header)
+            for row in rows:
+                record = dict(zip(header, row))
+                if AMOUNT_COLUMN in record:
+                    amount = parse_amount(record[AMOUNT_COLUMN])
+                    record[AMOUNT_COLUMN] = "" if amount is None else str(amount)
+                writer.writerow([record[column] for column in header])
+            row_count += len(rows)
+    return row_count
+
+
+def get_parquet_schema(header: list[str]):
+    """Builds the Parquet schema for the sheet, typing the amount and date columns."""
+    fields = []
+    for column in header:
+        if column == AMOUNT_COLUMN:
+            fields.append(
+                pa.field(column, pa.decimal128(AMOUNT_PRECISION, AMOUNT_SCALE))
+            )
+        elif column == DATE_COLUMN:
+            fields.append(pa.field(column, pa.date32()))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+
+def parse_parquet_amount(value: str):
+    """Parses an amount for the Parquet export, or None if it does not fit the amount column."""
+    amount = parse_amount(value)
+    if amount is not None and abs(amount) > MAX_PARQUET_AMOUNT:
+        logger.warning("Exporting the out of range amount %r as null", value)
+        return None
+    return amount
+
+
+def write_parquet_export(pages, path: str) -> int:
+    """Streams the sheet pages into a Parquet file, one row group per page, and returns the row count."""
+    row_count = 0
+    writer = None
+    try:
+        for header, rows in pages:
+            if writer is None:
+                schema = get_parquet_schema(header)
+                writer = pq.ParquetWriter(path, schema, compression="snappy")
+
+            columns = []
+            for index, column in enumerate(header):
+                values = [row[index] for row in rows]
+                if column == AMOUNT_COLUMN:
+                    values = [parse_parquet_amount(value) for value in values]
+                elif column == DATE_COLUMN:
+                    values = [parse_date(value) for value in values]
+                columns.append(values)
+
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            row_count += len(rows)
+
+        if writer is None:
+            # The sheet has no header at all, so there are no columns to write
+            pq.write_table(pa.table({}), path)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
+
+
+def export_command(update: Update, context: CallbackContext) -> None:
+    """
+    Admin command that exports every claim to a CSV or Parquet file.
+    Usage: /export [csv|parquet]
+    """
+    if not is_admin(update):
+        notify_not_authorised(update)
+        return
+
+    export_format = context.args[0].lower() if context.args else "csv"
+    if export_format not in ["csv", "parquet"]:
+        update.message.reply_text("Usage: /export [csv|parquet]")
+        return
+    if export_format == "parquet" and pq is None:
+        update.message.reply_text(
+            "⚠️ Parquet exports need `pyarrow` installed. Please use /export csv instead.",
+            parse_mode="Markdown",
+        )
+        return
+
+    update.message.reply_text("⏳ Exporting claims, this may take a moment...")
+
+    export_directory = get_current_tenant().path(EXPORT_DIRECTORY)
+    os.makedirs(export_directory, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = "csv.gz" if export_format == "csv" else "parquet"
+    filename = f"claims_{timestamp}.{extension}"
+    path = os.path.join(export_directory, filename)
+
+    pages = fetch_sheet_pages(EXPORT_PAGE_SIZE)
+    start = time.perf_counter()
+    try:
+        if export_format == "csv":
+            row_count = write_csv_export(pages, path)
+        else:
+            row_count = write_parquet_export(pages, path)
+        elapsed = time.perf_counter() - start
+        rows_per_second = row_count / elapsed if elapsed > 0 else 0
+
+        with open(path, "rb") as export_file:
+            update.message.reply_document(
+                document=export_file,
+                filename=filename,
+                caption=(
+                    f"📦 Exported {row_count} claims in {elapsed:.1f}s "
+                    f"({rows_per_second:.0f} rows/s)"
+                ),
+            )
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,195 @@
+import json
+import uuid
+import threading
+import importlib.util
+from urllib.parse import quote
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+
+SHEETS_ENDPOINT = "https://sheets.googleapis.com"
+DRIVE_ENDPOINT = "https://www.googleapis.com"
+
+# Google only compresses responses for clients whose user agent mentions gzip
+USER_AGENT = "nepal-finance-bot (gzip)"
+
+
+class GoogleSession:
+    """
+    A pooled, thread-safe keep-alive HTTP session to the Google APIs, signed
+    with OAuth credentials that are reloaded (and refreshed) once they expire.
+    Uses HTTP/2 when the h2 package is installed.
+    """
+
+    def __init__(
+        self,
+        load_credentials,
+        timeout: float,
+        connect_timeout: float,
+        max_connections: int,
+        http2: bool = True,
+    ):
+        self.load_credentials = load_credentials
+        self.credentials = None
+        self.lock = threading.Lock()
+        self.client = httpx.Client(
+            http2=http2 and importlib.util.find_spec("h2") is not None,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"},
+        )
+
+    def get_token(self) -> str:
+        with self.lock:
+            if self.credentials is None or not self.credentials.valid:
+                self.credentials = self.load_credentials()
+            return self.credentials.token
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request, raising the same HttpError googleapiclient would for
+        an error response so callers and the circuit breakers cannot tell the two apart.
+        """
+        headers = {"Authorization": f"Bearer {self.get_token()}"}
+        headers.update(kwargs.pop("headers", {}))
+        response = self.client.request(method, url, headers=headers, **kwargs)
+        if response.status_code >= 400:
+            resp = httplib2.Response(
+                {"status": response.status_code, "reason": response.reason_phrase}
+            )
+            raise HttpError(resp, response.content, uri=str(response.url))
+        return response
+
+
+class RestRequest:
+    """A prepared request, run with execute() like a googleapiclient HttpRequest."""
+
+    def __init__(
+        self, session: GoogleSession, method: str, url: str, raw: bool = False, **kwargs
+    ):
+        self.session = session
+        self.method = method
+        self.url = url
+        self.raw = raw
+        self.kwargs = kwargs
+
+    def execute(self):
+        response = self.session.request(self.method, self.url, **self.kwargs)
+        return response.content if self.raw else response.json()
+
+
+def without_none(params: dict) -> dict:
+    return {key: value for key, value in params.items() if value is not None}
+
+
+class SheetsValues:
+    """The spreadsheets.values endpoints used by the bot."""
+
+    def __init__(self, session: GoogleSession, endpoint: str):
+        self.session = session
+        self.url = f"{endpoint}/v4/spreadsheets"
+
+    def get(self, spreadsheetId: str, range: str) -> RestRequest:
+        url = f"{self.url}/{spreadsheetId}/values/{quote(range)}"
+        return RestRequest(self.session, "GET", url)
+
+    def append(
+        self,
+        spreadsheetId: str,
+        range: str,
+        valueInputOption: str,
+        body: dict,
+        insertDataOption: str = None,
+    ) -> RestRequest:
+        url = f"{self.url}/{spreadsheetId}/values/{quote(range)}:append"
+        params = without_none(
+            {"valueInputOption": valueInputOption, "insertDataOption": insertDataOption}
+        )
+        return RestRequest(self.session, "POST", url, params=params, json=body)
+
+    def batchGet(self, spreadsheetId: str, ranges: list[str]) -> RestRequest:
+        url = f"{self.url}/{spreadsheetId}/values:batchGet"
+        return RestRequest(self.session, "GET", url, params={"ranges": ranges})
+
+    def batchUpdate(self, spreadsheetId: str, body: dict) -> RestRequest:
+        url = f"{self.url}/{spreadsheetId}/values:batchUpdate"
+        return RestRequest(self.session, "POST", url, json=body)
+
+
+class SheetsService:
+    """Stands in for build("sheets", "v4"), so service.spreadsheets().values()... works unchanged."""
+
+    def __init__(self, session: GoogleSession, endpoint: str = SHEETS_ENDPOINT):
+        self.session = session
+        self.endpoint = endpoint
+
+    def spreadsheets(self):
+        return self
+
+    def values(self) -> SheetsValues:
+        return SheetsValues(self.session, self.endpoint)
+
+
+class DriveFiles:
+    """The files endpoints used by the bot."""
+
+    def __init__(self, session: GoogleSession, endpoint: str):
+        self.session = session
+        self.url = f"{endpoint}/drive/v3/files"
+        self.upload_url = f"{endpoint}/upload/drive/v3/files"
+
+    def create(self, body: dict, media_body=None, fields: str = None) -> RestRequest:
+        params = without_none({"fields": fields})
+        if media_body is None:
+            return RestRequest(self.session, "POST", self.url, params=params, json=body)
+
+        # One multipart/related request carrying both the metadata and the file
+        boundary = uuid.uuid4().hex
+        content = (
+            f"--{boundary}\r\n"
+            "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+            f"{json.dumps(body)}\r\n"
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_body.mimetype()}\r\n\r\n"
+        ).encode()
+        content += media_body.getbytes(0, media_body.size())
+        content += f"\r\n--{boundary}--".encode()
+        return RestRequest(
+            self.session,
+            "POST",
+            self.upload_url,
+            params={"uploadType": "multipart", **params},
+            content=content,
+            headers={"Content-Type": f"multipart/related; boundary={boundary}"},
+        )
+
+    def list(
+        self,
+        q: str = None,
+        fields: str = None,
+        pageSize: int = None,
+        pageToken: str = None,
+    ) -> RestRequest:
+        params = without_none(
+            {"q": q, "fields": fields, "pageSize": pageSize, "pageToken": pageToken}
+        )
+        return RestRequest(self.session, "GET", self.url, params=params)
+
+    def get_media(self, fileId: str) -> RestRequest:
+        url = f"{self.url}/{quote(fileId)}"
+        return RestRequest(self.session, "GET", url, raw=True, params={"alt": "media"})
+
+
+class DriveService:
+    """Stands in for build("drive", "v3"), so service.files()... works unchanged."""
+
+    def __init__(self, session: GoogleSession, endpoint: str = DRIVE_ENDPOINT):
+        self.session = session
+        self.endpoint = endpoint
+
+    def files(self) -> DriveFiles:
+        return DriveFiles(self.session, self.endpoint)
@@ -0,0 +1,28 @@
+from telegram import ReplyKeyboardMarkup
+
+
+def create_reply_keyboard(
+    options: list[str], rows: int, columns: int, placeholder: str = None
+) -> ReplyKeyboardMarkup:
+    """
+    Generates a dynamic reply keyboard for the user based on the provided shape (rows and columns).
+    """
+    # Create the keyboard layout based on the given rows and columns
+    keyboard_layout = [
+        options[i : i + columns] for i in range(0, len(options), columns)
+    ]
+
+    return ReplyKeyboardMarkup(
+        keyboard_layout,
+        one_time_keyboard=True,
+        input_field_placeholder=placeholder,
+        selective=True,  # Ensures only the user sees the keyboard
+    )
+
+
+def get_main_menu_keyboard(rows: int, columns: int) -> ReplyKeyboardMarkup:
+    """Generates the main menu reply keyboard for the user with custom rows and columns."""
+    options = ["Submit a Claim", "Check Claim Status", "Submit Proof of Payment"]
+    return create_reply_keyboard(
+        options, rows, columns, placeholder="Select one of the options below"
+    )
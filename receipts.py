@@ -0,0 +1,79 @@
+import os
+import threading
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.utils.helpers import escape_markdown
+
+from claim_store import get_receipt
+from drive_connector import config, download_receipt
+from error_handling import notify_not_authorised
+from utils import is_admin
+
+RECEIPT_CACHE_DIRECTORY = config["receipt_cache"]["directory"]
+RECEIPT_CACHE_SIZE = config["receipt_cache"]["max_files"]
+
+cache_lock = threading.Lock()
+
+
+def evict_receipt_cache() -> None:
+    """Removes the least recently viewed receipts once the cache holds too many."""
+    cached = [
+        os.path.join(RECEIPT_CACHE_DIRECTORY, filename)
+        for filename in os.listdir(RECEIPT_CACHE_DIRECTORY)
+    ]
+    if len(cached) <= RECEIPT_CACHE_SIZE:
+        return
+    cached.sort(key=os.path.getmtime)
+    for path in cached[: len(cached) - RECEIPT_CACHE_SIZE]:
+        os.remove(path)
+
+
+def get_receipt_image(file_id: str) -> bytes:
+    """
+    Returns the receipt image, served from the on-disk cache when it was viewed
+    recently. The file's modification time doubles as its last-used time.
+    """
+    path = os.path.join(RECEIPT_CACHE_DIRECTORY, f"{file_id}.jpg")
+    with cache_lock:
+        if os.path.exists(path):
+            os.utime(path)  # mark as recently used
+            with open(path, "rb") as file:
+                return file.read()
+
+    image = download_receipt(file_id)
+
+    with cache_lock:
+        os.makedirs(RECEIPT_CACHE_DIRECTORY, exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(image)
+        evict_receipt_cache()
+    return image
+
+
+def receipt_command(update: Update, context: CallbackContext) -> None:
+    """
+    Admin command that sends back the receipt for a claim.
+    Usage: /receipt <claim id>
+    """
+    if not is_admin(update):
+        notify_not_authorised(update)
+        return
+
+    if len(context.args) != 1:
+        update.message.reply_text("Usage: /receipt <claim id>")
+        return
+
+    claim_id = context.args[0]
+    receipt = get_receipt(claim_id)
+    if receipt is None:
+        update.message.reply_text(
+            f"⚠️ No receipt found for claim ID '{escape_markdown(claim_id)}'.\n\n"
+            "If this is an older claim, run `python claim_store.py backfill` to index the existing receipts.",
+            parse_mode="Markdown",
+        )
+        return
+
+    update.message.reply_photo(
+        photo=get_receipt_image(receipt["id"]),
+        caption=f"🧾 Receipt for claim {claim_id}",
+    )
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import CallbackContext
+
+from bot_logging import setup_logging
+from circuit_breaker import ServiceUnavailableError
+from claim_store import (
+    connect,
+    get_journaled_row,
+    get_receipt,
+    normalise_claim_id,
+    record_sheet_claims,
+    store_lock,
+)
+from drive_connector import (
+    RECEIPT_DETAILS_COLUMN,
+    SAMPLE_RANGE_NAME,
+    append_claim_row,
+    batch_get_ranges,
+    config,
+    get_admin_ids,
+    list_folder_files,
+    receipt_details,
+    tenant_registry,
+)
+from error_handling import notify_not_authorised
+from submission_queue import queued_receipt_names, write_json_atomically
+from tenants import get_current_tenant, tenant_context
+from utils import is_admin
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PATH = config["reconcile"]["checkpoint_path"]
+AUTO_REPAIR = config["reconcile"]["auto_repair"]
+# Receipts younger than this may still be waiting for their row to be appended
+ORPHAN_GRACE_PERIOD = timedelta(minutes=config["reconcile"]["orphan_grace_minutes"])
+
+# Listing more than this many problems in a Telegram message is not useful
+REPORT_LIMIT = 20
+
+
+def load_checkpoint() -> dict:
+    """Loads where the tenant's last run stopped: the newest Drive file seen and the sheet rows read."""
+    checkpoint_path = get_current_tenant().path(CHECKPOINT_PATH)
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r") as file:
+            return json.load(file)
+    return {"drive_created_after": None, "sheet_rows_seen": 0}
+
+
+def sync_drive_files(checkpoint: dict) -> int:
+    """Lists the claim receipts created since the checkpoint, page by page, into the claim store."""
+    query = None
+    if checkpoint["drive_created_after"]:
+        # Use >= so files created in the same instant as the checkpoint are not missed
+        query = f"createdTime >= '{checkpoint['drive_created_after']}'"
+
+    listed = 0
+    for files in list_folder_files(
+        get_current_tenant().claim_receipt_folder_id,
+        fields="id, name, createdTime",
+        query=query,
+    ):
+        rows = [
+            (
+                normalise_claim_id(file["name"].rsplit(".", 1)[0]),
+                file["id"],
+                file["createdTime"],
+            )
+            for file in files
+        ]
+        with store_lock:
+            connection = connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO drive_files VALUES (?, ?, ?)", rows
+                )
+            connection.close()
+
+        for _, _, created_time in rows:
+            # RFC 3339 timestamps in UTC compare correctly as strings
+            if created_time > (checkpoint["drive_created_after"] or ""):
+                checkpoint["drive_created_after"] = created_time
+        listed += len(rows)
+    return listed
+
+
+def sync_sheet_claim_ids(checkpoint: dict) -> int:
+    """Reads only the Claim ID column of the rows added since the checkpoint."""
+    sheet_name, columns = SAMPLE_RANGE_NAME.split("!")
+    claim_id_col = columns.split(":")[0]
+    first_row = checkpoint["sheet_rows_seen"] + 2  # row 1 is the header
+
+    (claim_ids,) = batch_get_ranges(
+        [f"{sheet_name}!{claim_id_col}{first_row}:{claim_id_col}"]
+    )
+    record_sheet_claims(
+        [
+            (cell[0], first_row + index)
+            for index, cell in enumerate(claim_ids)
+            if cell and cell[0].strip()
+        ]
+    )
+    checkpoint["sheet_rows_seen"] += len(claim_ids)
+    return len(claim_ids)
+
+
+def find_mismatches() -> tuple[list, list]:
+    """
+    Computes both set differences in one pass over the claim store:
+    orphans are receipts in Drive with no sheet row, dangling rows are sheet
+    rows with no receipt in Drive.
+    """
+    cutoff = (datetime.now(timezone.utc) - ORPHAN_GRACE_PERIOD).strftime(
+        "%Y-%m-%dT%H:%M:%S"
+    )
+    with store_lock:
+        connection = connect()
+        orphans = connection.execute(
+            """
+            SELECT drive_files.claim_id, drive_files.file_id FROM drive_files
+            LEFT JOIN claims ON claims.claim_id = drive_files.claim_id
+                AND claims.row_number IS NOT NULL
+            WHERE claims.claim_id IS NULL AND drive_files.created_time < ?
+            ORDER BY drive_files.created_time
+            """,
+            (cutoff,),
+        ).fetchall()
+        dangling = connection.execute(
+            """
+            SELECT claims.claim_id, claims.row_number FROM claims
+            LEFT JOIN drive_files ON drive_files.claim_id = claims.claim_id
+            WHERE claims.row_number IS NOT NULL AND drive_files.claim_id IS NULL
+            ORDER BY claims.row_number
+            """
+        ).fetchall()
+        connection.close()
+    return orphans, dangling
+
+
+def repair_orphan(claim_id: str) -> bool:
+    """Re-appends the journaled row of an orphaned receipt. Returns False if there is no journaled row."""
+    row = get_journaled_row(claim_id)
+    if row is None:
+        return False
+
+    # Rows queued while Drive was down were built before the receipt was uploaded
+    if not row[RECEIPT_DETAILS_COLUMN]:
+        row[RECEIPT_DETAILS_COLUMN:] = receipt_details(get_receipt(claim_id))
+    append_claim_row(row)
+    return True
+
+
+def reconcile(repair: bool = False, full: bool = False) -> dict:
+    """
+    Brings the claim store up to date with the Drive receipts and sheet rows
+    added since the last run, then reports (and optionally repairs) orphans and
+    dangling rows. A full run starts again from scratch, which also picks up
+    deleted files and rows.
+    """
+    if full:
+        checkpoint = {"drive_created_after": None, "sheet_rows_seen": 0}
+        with store_lock:
+            connection = connect()
+            with connection:
+                connection.execute("DELETE FROM drive_files")
+                connection.execute("UPDATE claims SET row_number = NULL")
+            connection.close()
+    else:
+        checkpoint = load_checkpoint()
+
+    new_files = sync_drive_files(checkpoint)
+    new_rows = sync_sheet_claim_ids(checkpoint)
+    orphans, dangling = find_mismatches()
+
+    repaired = []
+    if repair:
+        # Claims still in the degraded mode queue will get their row when it drains
+        queued = queued_receipt_names()
+        for claim_id, _ in orphans:
+            if claim_id not in queued and repair_orphan(claim_id):
+                repaired.append(claim_id)
+        orphans = [orphan for orphan in orphans if orphan[0] not in repaired]
+        # Repaired rows are appended after the rows we have already read
+        new_rows += sync_sheet_claim_ids(checkpoint)
+
+    write_json_atomically(get_current_tenant().path(CHECKPOINT_PATH), checkpoint)
+
+    report = {
+        "new_files": new_files,
+        "new_rows": new_rows,
+        "orphans": orphans,
+        "dangling": dangling,
+        "repaired": repaired,
+    }
+    logger.info(
+        "Reconciliation: %d new files, %d new rows, %d orphans, %d dangling rows, %d repaired",
+        new_files,
+        new_rows,
+        len(orphans),
+        len(dangling),
+        len(repaired),
+    )
+    return report
+
+
+def format_reconciliation_report(report: dict) -> str:
+    """Formats the reconciliation report as a Telegram message."""
+    lines = [
+        "🧮 *Reconciliation Report*",
+        f"Checked {report['new_files']} new receipts and {report['new_rows']} new sheet rows.",
+        "",
+        f"✅ Repaired: {len(report['repaired'])}",
+        f"📎 Receipts with no sheet row: {len(report['orphans'])}",
+    ]
+    lines += [f"  `{claim_id}`" for claim_id, _ in report["orphans"][:REPORT_LIMIT]]
+    lines.append(f"📄 Sheet rows with no receipt: {len(report['dangling'])}")
+    lines += [
+        f"  row {row_number}: `{claim_id}`"
+        for claim_id, row_number in report["dangling"][:REPORT_LIMIT]
+    ]
+    return "\n".join(lines)
+
+
+def reconcile_command(update: Update, context: CallbackContext) -> None:
+    """
+    Admin command that reconciles the Drive receipts against the sheet.
+    Usage: /reconcile [repair] [full]
+    """
+    if not is_admin(update):
+        notify_not_authorised(update)
+        return
+
+    update.message.reply_text("⏳ Reconciling receipts and claims...")
+    report = reconcile(repair="repair" in context.args, full="full" in context.args)
+    update.message.reply_text(
+        format_reconciliation_report(report), parse_mode="Markdown"
+    )
+
+
+def nightly_reconciliation(context: CallbackContext) -> None:
+    """
+    Daily job that reconciles every tenant incrementally and messages the
+    tenant's admins if anything is wrong.
+    """
+    for tenant in tenant_registry.all():
+        # A failure for one trip must not stop the others from being reconciled
+        try:
+            with tenant_context(tenant):
+                report = reconcile(repair=AUTO_REPAIR)
+        except ServiceUnavailableError as err:
+            logger.warning("Could not reconcile tenant %s: %s", tenant.name, err)
+            continue
+        except Exception:
+            logger.exception("Reconciling tenant %s failed", tenant.name)
+            continue
+        if not (report["orphans"] or report["dangling"] or report["repaired"]):
+            continue
+
+        message = format_reconciliation_report(report)
+        bot = tenant_registry.get_bot(tenant) or context.bot
+        for user_id in get_admin_ids(tenant):
+            try:
+                bot.send_message(chat_id=user_id, text=message, parse_mode="Markdown")
+            except TelegramError as err:
+                # e.g. an admin who has never started the bot
+                logger.error(
+                    "Could not send the %s reconciliation report to %s: %s",
+                    tenant.name,
+                    user_id,
+                    err,
+                )
+
+
+if __name__ == "__main__":
+    setup_logging()
+    for tenant in tenant_registry.all():
+        with tenant_context(tenant):
+            report = reconcile(repair="--repair" in sys.argv, full="--full" in sys.argv)
+        print(f"[{tenant.name}]")
+        print(format_reconciliation_report(report))
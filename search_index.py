@@ -0,0 +1,295 @@
+import re
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.utils.helpers import escape_markdown
+
+from drive_connector import (
+    add_claim_listener,
+    config,
+    fetch_sheet_pages,
+    tenant_registry,
+)
+from error_handling import notify_not_authorised
+from export import parse_amount, parse_date
+from tenants import get_current_tenant
+from utils import is_admin
+
+SEARCH_PAGE_SIZE = config["search"]["page_size"]
+SEARCH_RESULTS_PER_PAGE = config["search"]["results_per_page"]
+# Rebuild the index this often, to pick up rows edited or added outside the bot
+SEARCH_REFRESH_SECONDS = config["search"]["refresh_minutes"] * 60
+
+SEARCH_USAGE = (
+    "Usage: /search publicity bus from:2024-09-01 to:2024-09-30 min:10 max:100 page:1\n\n"
+    "Words can be limited to a column, e.g. category:publicity or name:john\n"
+    "Add refresh to re-read the sheet first."
+)
+
+# Columns whose words are added to the inverted index
+TEXT_COLUMNS = ["Description", "Category", "Name"]
+CLAIM_ID_COLUMN = "Claim ID"
+AMOUNT_COLUMN = "Amount"
+DATE_COLUMN = "Date"
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits free text into lowercase search tokens."""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+class ClaimSearchIndex:
+    """
+    In-memory index over the claims in the sheet. Words in the text columns
+    are kept in an inverted index (token -> claim positions), both on their
+    own and qualified by column (e.g. 'category:publicity'), while dates and
+    amounts are kept in sorted lists so range filters are two bisects.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at = None
+        self.header = []
+        self.claims = []
+        self.claim_ids = set()
+        self.postings = defaultdict(set)
+        self.by_date = []
+        self.by_amount = []
+
+    def load(self, pages) -> None:
+        """(Re)builds the index from the (header, rows) pages of the sheet."""
+        with self.lock:
+            self.header = []
+            self.claims = []
+            self.claim_ids = set()
+            self.postings = defaultdict(set)
+            self.by_date = []
+            self.by_amount = []
+            for header, rows in pages:
+                self.header = header
+                for row in rows:
+                    self._add(dict(zip(header, row)), keep_sorted=False)
+            # Sorting once after a bulk load is cheaper than inserting in order
+            self.by_date.sort()
+            self.by_amount.sort()
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def is_stale(self, max_age: float) -> bool:
+        """True if the index has never been loaded, or was loaded more than max_age seconds ago."""
+        return not self.loaded or time.monotonic() - self.loaded_at > max_age
+
+    def add_row(self, row: list[str], row_number: int = None) -> None:
+        """Adds a newly appended sheet row. Ignored until the index has been loaded."""
+        with self.lock:
+            if self.loaded:
+                self._add(dict(zip(self.header, row)))
+
+    def _add(self, claim: dict, keep_sorted: bool = True) -> None:
+        claim_id = claim.get(CLAIM_ID_COLUMN, "")
+        if claim_id in self.claim_ids:
+            return
+        self.claim_ids.add(claim_id)
+
+        position = len(self.claims)
+        self.claims.append(claim)
+
+        for column in TEXT_COLUMNS:
+            for token in tokenize(claim.get(column, "")):
+                self.postings[token].add(position)
+                self.postings[f"{column.lower()}:{token}"].add(position)
+
+        add = insort if keep_sorted else list.append
+
+        claim_date = parse_date(claim.get(DATE_COLUMN, ""))
+        if claim_date is not None:
+            add(self.by_date, (claim_date, position))
+
+        amount = parse_amount(claim.get(AMOUNT_COLUMN, ""))
+        if amount is not None:
+            add(self.by_amount, (amount, position))
+
+    def _range(self, entries: list, low, high) -> set:
+        """Returns the positions whose key lies within [low, high] (either bound may be None)."""
+        start = 0 if low is None else bisect_left(entries, (low, -1))
+        if high is None:
+            end = len(entries)
+        else:
+            end = bisect_right(entries, (high, len(self.claims)))
+        return {position for _, position in entries[start:end]}
+
+    def search(
+        self,
+        terms: list[str],
+        date_from=None,
+        date_to=None,
+        min_amount=None,
+        max_amount=None,
+    ) -> list[dict]:
+        """Returns the claims matching every term and filter, newest first."""
+        with self.lock:
+            candidates = []
+            for term in terms:
+                field, _, value = term.lower().rpartition(":")
+                for token in tokenize(value):
+                    key = f"{field}:{token}" if field else token
+                    candidates.append(self.postings.get(key, set()))
+
+            if date_from is not None or date_to is not None:
+                candidates.append(self._range(self.by_date, date_from, date_to))
+            if min_amount is not None or max_amount is not None:
+                candidates.append(self._range(self.by_amount, min_amount, max_amount))
+
+            if candidates:
+                # Intersect starting from the smallest set to keep the work small
+                candidates.sort(key=len)
+                matches = set(candidates[0])
+                for positions in candidates[1:]:
+                    matches &= positions
+            else:
+                matches = set(range(len(self.claims)))
+
+            return [self.claims[position] for position in sorted(matches, reverse=True)]
+
+
+claim_indexes = {}  # tenant name -> ClaimSearchIndex
+claim_indexes_lock = threading.Lock()
+
+
+def get_claim_index() -> ClaimSearchIndex:
+    """Returns the search index of the current tenant, creating it on first use."""
+    tenant_name = get_current_tenant().name
+    with claim_indexes_lock:
+        if tenant_name not in claim_indexes:
+            claim_indexes[tenant_name] = ClaimSearchIndex()
+        return claim_indexes[tenant_name]
+
+
+def index_new_claim(new_row: list[str], row_number: int) -> None:
+    """Claim listener that adds each appended row to its tenant's index."""
+    get_claim_index().add_row(new_row, row_number)
+
+
+def forget_claim_index(tenant_name: str) -> None:
+    """Drops the index of a tenant whose spreadsheet changed or that was removed."""
+    with claim_indexes_lock:
+        claim_indexes.pop(tenant_name, None)
+
+
+# Keep the index up to date as new claims are appended to the sheet
+add_claim_listener(index_new_claim)
+tenant_registry.add_reload_listener(forget_claim_index)
+
+
+def parse_search_args(args: list[str]) -> dict:
+    """
+    Splits the /search arguments into free-text terms and filters.
+    Supported filters: from:YYYY-MM-DD to:YYYY-MM-DD min:<amount> max:<amount> page:<n>
+    Raises ValueError if a filter's value is invalid, rather than silently dropping it.
+    """
+    query = {
+        "terms": [],
+        "date_from": None,
+        "date_to": None,
+        "min_amount": None,
+        "max_amount": None,
+        "page": 1,
+    }
+    filters = {
+        "from": ("date_from", parse_date),
+        "to": ("date_to", parse_date),
+        "min": ("min_amount", parse_amount),
+        "max": ("max_amount", parse_amount),
+    }
+    for arg in args:
+        key, _, value = arg.partition(":")
+        key = key.lower()
+        if key in filters and value:
+            field, parse = filters[key]
+            query[field] = parse(value)
+            if query[field] is None:
+                raise ValueError(f"Invalid {key} filter: {value}")
+        elif key == "page" and value.isdigit():
+            query["page"] = max(int(value), 1)
+        else:
+            query["terms"].append(arg)
+    return query
+
+
+def format_search_result(claim: dict) -> str:
+    """Formats a single claim as one line of the search results."""
+    description = claim.get("Description", "")
+    if len(description) > 40:
+        description = description[:37] + "..."
+    # The claim details are typed by users, so escape them before they reach the Markdown
+    date, category, amount, name, description = (
+        escape_markdown(text)
+        for text in [
+            claim.get(DATE_COLUMN, ""),
+            claim.get("Category", ""),
+            claim.get(AMOUNT_COLUMN, ""),
+            claim.get("Name", ""),
+            description,
+        ]
+    )
+    return (
+        f"`{claim.get(CLAIM_ID_COLUMN, '')}` | {date} | {category} | {amount} | "
+        f"{name}\n    {description}"
+    )
+
+
+def search_command(update: Update, context: CallbackContext) -> None:
+    """
+    Admin command that searches the claims. Adding "refresh" rebuilds the index first.
+    Usage: /search [words] [column:word] [from:YYYY-MM-DD] [to:YYYY-MM-DD] [min:x] [max:x] [page:n] [refresh]
+    """
+    if not is_admin(update):
+        notify_not_authorised(update)
+        return
+
+    if not context.args:
+        update.message.reply_text(SEARCH_USAGE)
+        return
+
+    args = [arg for arg in context.args if arg.lower() != "refresh"]
+    refresh = len(args) < len(context.args)
+
+    try:
+        query = parse_search_args(args)
+    except ValueError as err:
+        # Searching without the filter would look like a real answer
+        update.message.reply_text(f"⚠️ {err}\n\n{SEARCH_USAGE}")
+        return
+    page = query.pop("page")
+
+    claim_index = get_claim_index()
+    if refresh or claim_index.is_stale(SEARCH_REFRESH_SECONDS):
+        update.message.reply_text(
+            "⏳ Building the search index, this may take a moment..."
+        )
+        claim_index.load(fetch_sheet_pages(SEARCH_PAGE_SIZE))
+
+    start = time.perf_counter()
+    results = claim_index.search(**query)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if not results:
+        update.message.reply_text(f"🔍 No claims found ({elapsed_ms:.1f} ms).")
+        return
+
+    total_pages = -(-len(results) // SEARCH_RESULTS_PER_PAGE)
+    page = min(page, total_pages)
+    start_index = (page - 1) * SEARCH_RESULTS_PER_PAGE
+    page_results = results[start_index : start_index + SEARCH_RESULTS_PER_PAGE]
+
+    message = (
+        f"🔍 *{len(results)} claims found* ({elapsed_ms:.1f} ms) - page {page}/{total_pages}\n\n"
+        + "\n".join(format_search_result(claim) for claim in page_results)
+    )
+    if page < total_pages:
+        message += f"\n\nAdd `page:{page + 1}` to see more results."
+    update.message.reply_text(message, parse_mode="Markdown")
@@ -0,0 +1,264 @@
+import os
+import json
+import uuid
+import logging
+import threading
+from datetime import datetime
+from telegram.error import TelegramError
+from telegram.ext import CallbackContext
+from googleapiclient.errors import HttpError
+
+from circuit_breaker import ServiceUnavailableError
+from drive_connector import (
+    RECEIPT_DETAILS_COLUMN,
+    append_claim_row,
+    config,
+    drive_breaker,
+    fetch_sheet,
+    get_admin_ids,
+    ping_drive,
+    receipt_details,
+    sheets_breaker,
+    tenant_registry,
+    upload_receipt,
+)
+from tenants import get_current_tenant, tenant_context
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DIRECTORY = config["submission_queue"]["directory"]
+# Subdirectory of the queue that rejected submissions are moved to, for the finance team to look at
+FAILED_DIRECTORY = "failed"
+
+# Stops two overlapping drains from completing the same submission twice
+drain_lock = threading.Lock()
+
+
+def get_queue_directory() -> str:
+    """Returns the directory holding the current tenant's queued submissions."""
+    return get_current_tenant().path(QUEUE_DIRECTORY)
+
+
+def write_json_atomically(path: str, data: dict) -> None:
+    """Writes the JSON file via a temporary file so a crash never leaves half a file behind."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(temp_path, path)
+
+
+def queue_submission(
+    chat_id: int,
+    receipt_name: str,
+    folder_id: str,
+    new_row: list[str] = None,
+    receipt_bytes: bytes = None,
+) -> None:
+    """
+    Saves a submission locally so it can be completed once Google recovers.
+    Pass the receipt bytes if the receipt itself could not be uploaded to Drive,
+    and the sheet row for claims (proofs of payment have no row).
+    """
+    queue_directory = get_queue_directory()
+    os.makedirs(queue_directory, exist_ok=True)
+
+    # Receipt names contain what the user typed, so the files are named from a
+    # generated ID instead. The time prefix drains the queue in submission order.
+    queued_at = datetime.now()
+    item_id = f"{queued_at.strftime('%Y%m%d%H%M%S%f')}_{uuid.uuid4().hex}"
+
+    if receipt_bytes is not None:
+        with open(os.path.join(queue_directory, f"{item_id}.jpg"), "wb") as file:
+            file.write(receipt_bytes)
+
+    item = {
+        "chat_id": chat_id,
+        "receipt_name": receipt_name,
+        "folder_id": folder_id,
+        "row": new_row,
+        "receipt_uploaded": receipt_bytes is None,
+        "queued_at": queued_at.isoformat(),
+    }
+    write_json_atomically(os.path.join(queue_directory, f"{item_id}.json"), item)
+    logger.info("Queued submission %s until Google is available", receipt_name)
+
+
+def list_queued_submissions() -> list[str]:
+    """Returns the paths of the current tenant's queued submissions, oldest first."""
+    queue_directory = get_queue_directory()
+    if not os.path.isdir(queue_directory):
+        return []
+    return [
+        os.path.join(queue_directory, filename)
+        for filename in sorted(os.listdir(queue_directory))
+        if filename.endswith(".json")
+    ]
+
+
+def queued_receipt_names() -> set[str]:
+    """Returns the lowercase receipt names of every queued submission."""
+    names = set()
+    for path in list_queued_submissions():
+        with open(path, "r") as file:
+            names.add(json.load(file)["receipt_name"].lower())
+    return names
+
+
+def complete_queued_submission(path: str) -> dict:
+    """Uploads the receipt and appends the row (where needed) for one queued submission, then removes it."""
+    with open(path, "r") as file:
+        item = json.load(file)
+
+    # The receipt is saved next to the queue file, under the same generated ID
+    receipt_path = f"{path[: -len('.json')]}.jpg"
+    if not item["receipt_uploaded"]:
+        with open(receipt_path, "rb") as file:
+            receipt_file = upload_receipt(
+                item["receipt_name"], file.read(), item["folder_id"]
+            )
+        # Record the upload so a failed append does not upload the receipt twice
+        item["receipt_uploaded"] = True
+        if item["row"] is not None:
+            item["row"][RECEIPT_DETAILS_COLUMN:] = receipt_details(receipt_file)
+        write_json_atomically(path, item)
+        os.remove(receipt_path)
+
+    if item["row"] is not None:
+        append_claim_row(item["row"])
+    os.remove(path)
+    return item
+
+
+def move_to_failed_directory(path: str) -> str:
+    """Moves a queued submission and its receipt (if any) out of the queue, returning where they went."""
+    failed_directory = os.path.join(os.path.dirname(path), FAILED_DIRECTORY)
+    os.makedirs(failed_directory, exist_ok=True)
+    item_path = path[: -len(".json")]
+    for extension in [".json", ".jpg"]:
+        if os.path.exists(f"{item_path}{extension}"):
+            os.replace(
+                f"{item_path}{extension}",
+                os.path.join(failed_directory, os.path.basename(item_path) + extension),
+            )
+    return failed_directory
+
+
+def send_messages(bot, chat_ids: list[int], text: str) -> None:
+    """Sends a plain text message to each chat, logging the chats it could not be sent to."""
+    for chat_id in chat_ids:
+        try:
+            bot.send_message(chat_id=chat_id, text=text)
+        except TelegramError as err:
+            logger.error("Could not message chat %s: %s", chat_id, err)
+
+
+def handle_rejected_submission(path: str, err: HttpError, bot) -> None:
+    """
+    Deals with a queued submission Google rejected, which retrying will not fix.
+    A claim whose receipt reached Drive is left to the reconciliation job, which
+    re-appends the row journaled in the claim store. Anything else is moved to
+    the failed directory, and the user and the finance team are told.
+    """
+    with open(path, "r") as file:
+        item = json.load(file)
+    receipt_name = item["receipt_name"]
+
+    if item["receipt_uploaded"] and item["row"] is not None:
+        logger.error(
+            "Queued claim %s was rejected, leaving it to reconciliation: %s",
+            receipt_name,
+            err,
+        )
+        os.remove(path)
+        send_messages(
+            bot,
+            [item["chat_id"]],
+            f"⚠️ Your receipt {receipt_name.capitalize()} was saved, but we could not add "
+            "your claim to the finance sheet just yet. The finance team will add it for "
+            "you, so there is no need to resubmit!",
+        )
+        return
+
+    failed_directory = move_to_failed_directory(path)
+    logger.error(
+        "Queued submission %s was rejected, moved it to %s: %s",
+        receipt_name,
+        failed_directory,
+        err,
+    )
+    send_messages(
+        bot,
+        [item["chat_id"]],
+        f"⚠️ Sorry, we could not save your submission {receipt_name.capitalize()}. "
+        "The finance team has been told and will be in touch, or you can submit it again.",
+    )
+    send_messages(
+        bot,
+        get_admin_ids(get_current_tenant()),
+        f"🚨 Google rejected the queued submission {receipt_name} of chat "
+        f"{item['chat_id']}. It was moved to {failed_directory}.\n\n{err}",
+    )
+
+
+def drain_submission_queue(context: CallbackContext) -> None:
+    """
+    Completes the queued submissions of the current tenant in order, stopping
+    at the first sign Google is down again.
+    """
+    if not drain_lock.acquire(blocking=False):
+        return
+    try:
+        # Reply through the bot the users submitted to
+        bot = tenant_registry.get_bot(get_current_tenant()) or context.bot
+        for path in list_queued_submissions():
+            try:
+                item = complete_queued_submission(path)
+            except ServiceUnavailableError as err:
+                logger.info("Google still unavailable, keeping the queue: %s", err)
+                return
+            except HttpError as err:
+                handle_rejected_submission(path, err, bot)
+                continue
+
+            logger.info("Completed queued submission %s", item["receipt_name"])
+            bot.send_message(
+                chat_id=item["chat_id"],
+                text=(
+                    f"✅ Your submission `{item['receipt_name'].capitalize()}` has now been "
+                    "received. Thank you for your patience!"
+                ),
+                parse_mode="Markdown",
+            )
+    finally:
+        drain_lock.release()
+
+
+def check_backends(context: CallbackContext) -> None:
+    """
+    Job run every few seconds. While a backend's circuit is open it sends a
+    half-open probe (once the breaker allows one), and once every backend is
+    healthy again it drains any submissions that were queued in degraded mode.
+    """
+    tenants = tenant_registry.all()
+    if not tenants:
+        return
+
+    if not sheets_breaker.available:
+        try:
+            # Fetching the sheet also refreshes the status snapshot
+            with tenant_context(tenants[0]):
+                fetch_sheet()
+        except ServiceUnavailableError:
+            pass
+
+    if not drive_breaker.available:
+        try:
+            ping_drive()
+        except ServiceUnavailableError:
+            pass
+
+    for tenant in tenants:
+        if not (sheets_breaker.available and drive_breaker.available):
+            return
+        with tenant_context(tenant):
+            drain_submission_queue(context)
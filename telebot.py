@@ -2,10 +2,14 @@ from dotenv import load_dotenv
 
 import logging
 from telegram import Update
+from telegram.error import TelegramError
 from telegram.ext import (
     Updater,
+    CallbackQueryHandler,
     CommandHandler,
+    DispatcherHandlerStop,
     MessageHandler,
+    TypeHandler,
     Filters,
     CallbackContext,
     CallbackContext,
@@ -15,16 +19,30 @@ from telegram.ext import (
 from drive_connector import *
 from error_handling import *
 from utils import *
+from export import export_command
+from search_index import search_command
+from receipts import receipt_command
+from reconcile import nightly_reconciliation, reconcile_command
+from approvals import approval_callback, pending_command
+from dedup import processed_updates, save_processed_updates, skip_duplicate_updates
+from submission_queue import check_backends
+from tenants import FairScheduler, has_current_tenant
+
+from bot_logging import setup_logging
 
 # Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-BOTAPI_KEY = os.environ["BOTAPI_KEY"]
+BOTAPI_KEY = os.environ["BOTAPI_KEY"].strip()
+
+# Worker threads shared by every tenant, taking turns between them
+scheduler = FairScheduler(config["tenants"]["workers"])
+
+# Running bots by token. The main bot also runs the jobs for every tenant.
+updaters = {}
 
 
 def start(update: Update, context: CallbackContext) -> None:
@@ -104,18 +122,49 @@ def end_conversation(update: Update, context: CallbackContext) -> None:
     )
 
 
-def main() -> None:
+def route_update(update: Update, context: CallbackContext) -> None:
     """
-    Main function to start the bot.
+    Runs before every other handler. Works out which tenant the update belongs
+    to and hands it to the fair scheduler, which processes it again on a worker
+    thread with that tenant current.
     """
-    # Fetch the bot token from environment variables for security
-    updater = Updater(token=os.environ.get("BOTAPI_KEY").strip(), use_context=True)
+    if has_current_tenant():
+        # Already on a worker, let the other handlers run
+        return
+
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    tenant = tenant_registry.for_update(context.bot.token, chat_id)
+    if tenant is None:
+        logger.error("No tenant is set up for update %s, dropping it", update.update_id)
+    else:
+        dispatcher = context.dispatcher
+        scheduler.submit(tenant, lambda: dispatcher.process_update(update))
+    raise DispatcherHandlerStop()
+
+
+def start_updater(token: str) -> Updater:
+    """Starts polling one bot with every handler registered."""
+    updater = Updater(token=token, use_context=True)
     dispatcher = updater.dispatcher
 
+    # Route each update to its tenant, then drop redelivered updates before any other handler sees them
+    dispatcher.add_handler(TypeHandler(Update, route_update), group=-2)
+    dispatcher.add_handler(TypeHandler(Update, skip_duplicate_updates), group=-1)
+
     # Command Handlers
     dispatcher.add_handler(CommandHandler("start", start))
     dispatcher.add_handler(CommandHandler("end", end_conversation))
 
+    # Admin Command Handlers
+    dispatcher.add_handler(CommandHandler("export", export_command))
+    dispatcher.add_handler(CommandHandler("search", search_command))
+    dispatcher.add_handler(CommandHandler("receipt", receipt_command))
+    dispatcher.add_handler(CommandHandler("reconcile", reconcile_command))
+    dispatcher.add_handler(CommandHandler("pending", pending_command))
+    dispatcher.add_handler(
+        CallbackQueryHandler(approval_callback, pattern=r"^approval:")
+    )
+
     # Message Handlers
     dispatcher.add_handler(
         MessageHandler(Filters.text & ~Filters.command, handle_response)
@@ -131,9 +180,72 @@ def main() -> None:
 
     # Start polling to run the bot
     updater.start_polling()
+    updaters[token] = updater
+    tenant_registry.register_bot(updater.bot)
+    return updater
+
+
+def sync_updaters() -> None:
+    """Starts the bots of newly added tenants and stops those no tenant uses any more."""
+    tokens = tenant_registry.bot_tokens() | {BOTAPI_KEY}
+    for token in tokens - set(updaters):
+        # One bad token must not stop the other tenants' bots from starting
+        try:
+            start_updater(token)
+        except TelegramError as err:
+            names = [t.name for t in tenant_registry.all() if t.bot_token == token]
+            logger.error("Could not start the bot of tenants %s: %s", names, err)
+            continue
+        logger.info("Started a bot for a new tenant")
+    for token in set(updaters) - tokens:
+        tenant_registry.unregister_bot(token)
+        updaters.pop(token).stop()
+        logger.info("Stopped a bot no tenant uses any more")
+
+
+def reload_tenants(context: CallbackContext) -> None:
+    """Job that picks up changes to the tenants file without a restart."""
+    if tenant_registry.reload_if_changed():
+        sync_updaters()
+
+
+def main() -> None:
+    """
+    Main function to start the bot.
+    """
+    processed_updates.load()
+
+    # The main bot's token comes from environment variables for security
+    updater = start_updater(BOTAPI_KEY)
+    sync_updaters()
+
+    # Pick up added, changed and removed tenants
+    updater.job_queue.run_repeating(
+        reload_tenants, interval=config["tenants"]["reload_interval"]
+    )
+
+    # Probe Google while degraded and submit any claims queued in the meantime
+    updater.job_queue.run_repeating(
+        check_backends, interval=config["circuit_breaker"]["probe_interval"], first=0
+    )
+
+    # Persist the deduplication cache so redeliveries after a restart are recognised
+    updater.job_queue.run_repeating(
+        save_processed_updates, interval=config["dedup"]["save_interval"]
+    )
+
+    # Nightly reconciliation of Drive receipts against sheet rows
+    updater.job_queue.run_daily(
+        nightly_reconciliation,
+        time=datetime.strptime(config["reconcile"]["run_at"], "%H:%M").time(),
+    )
 
-    # Keep the bot running until interrupted
+    # Keep the bots running until interrupted
     updater.idle()
+    for token, tenant_updater in list(updaters.items()):
+        if token != BOTAPI_KEY:
+            tenant_updater.stop()
+    processed_updates.save()
 
 
 if __name__ == "__main__":
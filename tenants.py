@@ -0,0 +1,306 @@
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Name of the tenant configured through the environment variables
+DEFAULT_TENANT_NAME = "default"
+
+# Settings every tenant in the tenants file must have
+REQUIRED_SETTINGS = [
+    "spreadsheet_id",
+    "claim_receipt_folder_id",
+    "payment_proof_folder_id",
+]
+
+# Departments offered when a tenant does not list its own
+DEFAULT_DEPARTMENTS = [
+    "Logistics",
+    "Finance",
+    "First Aid",
+    "Blog",
+    "Publicity",
+    "Flights & Accoms",
+]
+
+
+class Tenant:
+    """
+    One trip served by the bot: its spreadsheet, Drive folders and departments,
+    and the bot and chats whose updates belong to it.
+    """
+
+    def __init__(self, name: str, settings: dict, is_default: bool = False):
+        self.name = name
+        self.is_default = is_default
+        self.spreadsheet_id = settings["spreadsheet_id"]
+        self.claim_receipt_folder_id = settings["claim_receipt_folder_id"]
+        self.payment_proof_folder_id = settings["payment_proof_folder_id"]
+        self.departments = settings.get("departments") or DEFAULT_DEPARTMENTS
+        self.admin_user_ids = settings.get("admin_user_ids") or []
+        self.approval_chat_id = settings.get("approval_chat_id")
+        self.chat_ids = set(settings.get("chat_ids") or [])
+        if self.approval_chat_id is not None:
+            self.chat_ids.add(self.approval_chat_id)
+
+        # Bot tokens are read from the environment so they never live in the tenants file.
+        # Tenants without a bot of their own share the main bot and are told apart by chat.
+        token_env = settings.get("bot_token_env") or "BOTAPI_KEY"
+        self.bot_token = os.environ.get(token_env, "").strip()
+        if not self.bot_token:
+            logger.error(
+                "Tenant %s has no bot token: %s is not set in the environment",
+                name,
+                token_env,
+            )
+
+    def path(self, filename: str) -> str:
+        """
+        Returns where this tenant keeps a local data file. The default tenant
+        keeps its files where a single-tenant bot always has.
+        """
+        if self.is_default:
+            return filename
+        directory = os.path.join("tenants", self.name)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+
+def get_settings_problem(settings) -> str:
+    """Returns what is wrong with a tenant's settings from the tenants file, or None if they are usable."""
+    if not isinstance(settings, dict):
+        return "its settings are not a mapping"
+    missing = [key for key in REQUIRED_SETTINGS if not settings.get(key)]
+    if missing:
+        return f"it has no {', '.join(missing)}"
+    return None
+
+
+class TenantRegistry:
+    """
+    Tenants loaded from the tenants file, plus a default tenant built from the
+    environment variables a single-trip bot has always used. The file is
+    re-read whenever it changes, so tenants can be added or edited without a restart.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.tenants = OrderedDict()
+        self.default = None
+        self.bots = {}  # bot token -> the running Bot with that token
+        # Functions called with the name of every tenant whose spreadsheet changed or that was removed
+        self.reload_listeners = []
+
+        if os.environ.get("SAMPLE_SPREADSHEET_ID"):
+            self.default = Tenant(
+                DEFAULT_TENANT_NAME,
+                {
+                    "spreadsheet_id": os.environ["SAMPLE_SPREADSHEET_ID"],
+                    "claim_receipt_folder_id": os.environ["CLAIM_RECEIPT_FOLDER_ID"],
+                    "payment_proof_folder_id": os.environ["PAYMENT_PROOF_FOLDER_ID"],
+                },
+                is_default=True,
+            )
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """Re-reads the tenants file if it changed. Returns True if the tenants were reloaded."""
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self.mtime:
+            return False
+
+        tenants = OrderedDict()
+        if mtime is not None:
+            try:
+                entries = self.read_entries()
+            except (OSError, yaml.YAMLError, ValueError) as err:
+                # Don't try again until the file changes, the error has been logged
+                self.mtime = mtime
+                logger.error(
+                    "Could not read %s, keeping the current tenants: %s", self.path, err
+                )
+                return False
+
+            for name, tenant_settings in entries.items():
+                if name == DEFAULT_TENANT_NAME:
+                    # Its caches and files would be shared with the trip configured in .env
+                    logger.error(
+                        "Ignoring the tenant named %s in %s, the name is reserved",
+                        name,
+                        self.path,
+                    )
+                    continue
+                problem = get_settings_problem(tenant_settings)
+                if problem is None:
+                    tenants[name] = Tenant(name, tenant_settings)
+                elif name in self.tenants:
+                    # A typo while editing a running trip should not take it offline
+                    logger.error(
+                        "Keeping the previous settings of tenant %s, %s in %s",
+                        name,
+                        problem,
+                        self.path,
+                    )
+                    tenants[name] = self.tenants[name]
+                else:
+                    logger.error(
+                        "Ignoring the tenant %s, %s in %s", name, problem, self.path
+                    )
+
+        with self.lock:
+            previous, self.tenants = self.tenants, tenants
+            self.mtime = mtime
+        logger.info("Loaded %d tenants from %s", len(tenants), self.path)
+
+        # Anything cached for a tenant's old spreadsheet is no longer valid
+        for name, tenant in previous.items():
+            if (
+                name not in tenants
+                or tenants[name].spreadsheet_id != tenant.spreadsheet_id
+            ):
+                for listener in self.reload_listeners:
+                    listener(name)
+        return True
+
+    def read_entries(self) -> dict:
+        """Reads the tenant name -> settings mapping from the tenants file."""
+        with open(self.path, "r") as file:
+            settings = yaml.safe_load(file) or {}
+        entries = settings.get("tenants") if isinstance(settings, dict) else settings
+        if not isinstance(entries or {}, dict):
+            raise ValueError("'tenants' must map each tenant's name to its settings")
+        return entries or {}
+
+    def add_reload_listener(self, listener) -> None:
+        """Registers a function to be called with the name of each tenant whose cached data must be dropped."""
+        self.reload_listeners.append(listener)
+
+    def all(self) -> list[Tenant]:
+        """Returns every tenant, the default one first."""
+        with self.lock:
+            tenants = list(self.tenants.values())
+        return ([self.default] if self.default else []) + tenants
+
+    def get(self, name: str) -> Tenant:
+        """Returns the tenant with the given name, or None if it no longer exists."""
+        for tenant in self.all():
+            if tenant.name == name:
+                return tenant
+        return None
+
+    def bot_tokens(self) -> set[str]:
+        """Returns the tokens of every bot the tenants are served through."""
+        return {tenant.bot_token for tenant in self.all() if tenant.bot_token}
+
+    def register_bot(self, bot) -> None:
+        """Records a running bot, so messages for its tenants can be sent outside of an update."""
+        self.bots[bot.token] = bot
+
+    def unregister_bot(self, token: str) -> None:
+        self.bots.pop(token, None)
+
+    def get_bot(self, tenant: Tenant):
+        """Returns the bot the tenant's users talk to, or None if it is not running."""
+        return self.bots.get(tenant.bot_token)
+
+    def for_update(self, bot_token: str, chat_id: int) -> Tenant:
+        """Finds the tenant of an update: by chat first, then by bot, falling back to the default."""
+        tenants = self.all()
+        for tenant in tenants:
+            if chat_id is not None and chat_id in tenant.chat_ids:
+                return tenant
+        for tenant in tenants:
+            if tenant.bot_token == bot_token:
+                return tenant
+        return tenants[0] if tenants else None
+
+
+current = threading.local()
+
+
+def has_current_tenant() -> bool:
+    """Returns True if this thread is already working for a tenant."""
+    return getattr(current, "tenant", None) is not None
+
+
+def get_current_tenant() -> Tenant:
+    """Returns the tenant whose update or job this thread is working on."""
+    tenant = getattr(current, "tenant", None)
+    if tenant is None:
+        raise RuntimeError("No tenant is active on this thread")
+    return tenant
+
+
+@contextmanager
+def tenant_context(tenant: Tenant):
+    """Makes the tenant current on this thread for the duration of the block."""
+    previous = getattr(current, "tenant", None)
+    current.tenant = tenant
+    try:
+        yield tenant
+    finally:
+        current.tenant = previous
+
+
+class FairScheduler:
+    """
+    Runs work for many tenants on a fixed pool of worker threads. Each tenant
+    has its own queue and runs one item at a time, so a user's messages are
+    still handled in order, while the workers take turns between tenants so a
+    busy trip cannot starve the others.
+    """
+
+    def __init__(self, workers: int):
+        self.condition = threading.Condition()
+        self.queues = OrderedDict()  # tenant name -> deque of (tenant, func)
+        self.running = set()
+        self.threads = [
+            threading.Thread(
+                target=self._work, name=f"tenant-worker-{index}", daemon=True
+            )
+            for index in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, tenant: Tenant, func) -> None:
+        """Queues func to run with the tenant current."""
+        with self.condition:
+            self.queues.setdefault(tenant.name, deque()).append((tenant, func))
+            self.condition.notify()
+
+    def _next(self):
+        """Takes the next item from the first idle tenant, then moves that tenant to the back."""
+        for name, queue in self.queues.items():
+            if queue and name not in self.running:
+                self.running.add(name)
+                self.queues.move_to_end(name)
+                return name, queue.popleft()
+        return None, None
+
+    def _work(self) -> None:
+        while True:
+            with self.condition:
+                name, item = self._next()
+                while item is None:
+                    self.condition.wait()
+                    name, item = self._next()
+
+            tenant, func = item
+            try:
+                with tenant_context(tenant):
+                    func()
+            except Exception:
+                logger.exception("Unhandled error while working for tenant %s", name)
+            finally:
+                with self.condition:
+                    self.running.discard(name)
+                    if not self.queues[name]:
+                        del self.queues[name]
+                    self.condition.notify()
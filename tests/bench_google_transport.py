@@ -0,0 +1,96 @@
+"""
+Compares the pooled REST client with the googleapiclient path the bot used
+before, against the local Google stand-in: per-request latency, and how many
+connections each transport opens for the same calls.
+
+Usage: python tests/bench_google_transport.py [requests]
+"""
+
+import os
+import sys
+import time
+import statistics
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google_rest import DriveService, GoogleSession, SheetsService
+from google_stand_in import StandInGoogle
+
+TIMEOUT = 10
+CREDENTIALS = Credentials(token="benchmark-token")
+
+
+def googleapiclient_calls(endpoint: str):
+    """The old path: a new client, and so a new connection, for every call."""
+
+    def sheets_get():
+        http = AuthorizedHttp(CREDENTIALS, http=httplib2.Http(timeout=TIMEOUT))
+        service = build(
+            "sheets", "v4", http=http, client_options={"api_endpoint": f"{endpoint}/"}
+        )
+        service.spreadsheets().values().get(
+            spreadsheetId="sheet", range="Sheet1!A:M"
+        ).execute()
+
+    def drive_list():
+        http = AuthorizedHttp(CREDENTIALS, http=httplib2.Http(timeout=TIMEOUT))
+        service = build(
+            "drive",
+            "v3",
+            http=http,
+            client_options={"api_endpoint": f"{endpoint}/drive/v3/"},
+        )
+        service.files().list(q="'folder' in parents", pageSize=1).execute()
+
+    return sheets_get, drive_list
+
+
+def rest_calls(endpoint: str):
+    """The new path: one pooled keep-alive session shared by every call."""
+    session = GoogleSession(
+        lambda: CREDENTIALS,
+        timeout=TIMEOUT,
+        connect_timeout=TIMEOUT,
+        max_connections=20,
+    )
+
+    def sheets_get():
+        SheetsService(session, endpoint).spreadsheets().values().get(
+            spreadsheetId="sheet", range="Sheet1!A:M"
+        ).execute()
+
+    def drive_list():
+        DriveService(session, endpoint).files().list(
+            q="'folder' in parents", pageSize=1
+        ).execute()
+
+    return sheets_get, drive_list
+
+
+def run(name: str, make_calls, requests: int) -> None:
+    with StandInGoogle() as google:
+        calls = make_calls(google.endpoint)
+        latencies = []
+        for index in range(requests):
+            call = calls[index % len(calls)]
+            start = time.perf_counter()
+            call()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        latencies.sort()
+        print(
+            f"{name:<16} median {statistics.median(latencies):7.2f} ms   "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.2f} ms   "
+            f"connections {len(google.connections)} for {len(google.requests)} requests"
+        )
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    run("googleapiclient", googleapiclient_calls, requests)
+    run("rest", rest_calls, requests)
@@ -0,0 +1,12 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The bot's modules read config.yaml and the trip's IDs from the environment on import
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("BOTAPI_KEY", "test-token")
+os.environ.setdefault("SAMPLE_SPREADSHEET_ID", "test-spreadsheet")
+os.environ.setdefault("CLAIM_RECEIPT_FOLDER_ID", "test-claim-folder")
+os.environ.setdefault("PAYMENT_PROOF_FOLDER_ID", "test-proof-folder")
@@ -0,0 +1,112 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+RECEIPT_BYTES = b"\xff\xd8\xff\xe0 not really a jpeg"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Sheets and Drive endpoints the bot uses with canned responses,
+    recording every request and the client port it arrived on.
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Send each response in one write, so delayed ACKs do not skew the latencies
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def handle_request(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        request = {
+            "method": self.command,
+            "path": unquote(url.path),
+            "query": parse_qs(url.query),
+            "headers": dict(self.headers),
+            "body": self.rfile.read(length),
+        }
+        server = self.server
+        with server.lock:
+            server.requests.append(request)
+            server.connections.add(self.client_address)
+
+        status, body = server.respond(request)
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            content_type = "application/json; charset=UTF-8"
+        else:
+            content_type = "image/jpeg"
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def default_response(request: dict):
+    """Canned responses for the endpoints the bot uses."""
+    path = request["path"]
+    if path.endswith(":append"):
+        return 200, {
+            "spreadsheetId": "sheet",
+            "updates": {"updatedRange": "Sheet1!A15:L15"},
+        }
+    if path.endswith("values:batchGet"):
+        ranges = request["query"].get("ranges", [])
+        return 200, {"valueRanges": [{"range": r, "values": [[r]]} for r in ranges]}
+    if path.endswith("values:batchUpdate"):
+        data = json.loads(request["body"])["data"]
+        return 200, {"totalUpdatedCells": len(data)}
+    if "/values/" in path:
+        return 200, {
+            "range": path.rsplit("/", 1)[1],
+            "values": [["Claim ID", "Name"], ["Abc", "Jo"]],
+        }
+    if path.startswith("/upload/drive/v3/files"):
+        return 200, {"id": "file-1", "size": "1234", "md5Checksum": "abc"}
+    if path == "/drive/v3/files":
+        return 200, {"files": [{"id": "file-1", "name": "abc.jpg"}]}
+    if path.startswith("/drive/v3/files/"):
+        return 200, RECEIPT_BYTES
+    return 404, {"error": {"code": 404, "message": "not found"}}
+
+
+class StandInGoogle(ThreadingHTTPServer):
+    """A local stand-in for the Google APIs, served from a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, respond=default_response):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.respond = respond
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = set()
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,55 @@
+from unittest import mock
+
+import pytest
+from telegram.error import BadRequest
+
+import approvals
+from approvals import format_approval_message
+
+
+def test_user_text_is_escaped_for_markdown():
+    row = ["Abc", "Finance", "Jo_b", "2024-09-01", "Bus_fare", "12", "*cheap* [bus]"]
+
+    message = format_approval_message(row, "Approved", decided_by="Sam_")
+
+    assert "*Name*: Jo\\_b\n" in message
+    assert "*Category*: Bus\\_fare\n" in message
+    assert "*Description*: \\*cheap\\* \\[bus]\n" in message
+    assert message.endswith("*Status*: Approved (by Sam\\_)")
+
+
+@pytest.fixture
+def lost_race(monkeypatch):
+    """Another admin has already approved claim Abc, moving it to version 1."""
+    monkeypatch.setattr(approvals, "is_admin", lambda update: True)
+    monkeypatch.setattr(approvals, "set_approval", lambda *args: False)
+    monkeypatch.setattr(
+        approvals, "get_approval", lambda claim_id: {"status": "Approved", "version": 1}
+    )
+
+
+def press_reject(edit_error):
+    """An admin's press of Reject on the version 0 keyboard."""
+    update = mock.MagicMock()
+    update.callback_query.data = "approval:reject:Abc:0"
+    update.callback_query.edit_message_reply_markup.side_effect = edit_error
+    approvals.approval_callback(update, mock.MagicMock())
+    return update.callback_query
+
+
+def test_losing_a_decision_to_the_same_message_is_not_an_error(lost_race):
+    query = press_reject(
+        BadRequest(
+            "Message is not modified: specified new message content and reply "
+            "markup are exactly the same as a current content and reply markup"
+        )
+    )
+
+    query.answer.assert_called_once_with("This claim was already updated to Approved.")
+    keyboard = query.edit_message_reply_markup.call_args.kwargs["reply_markup"]
+    assert keyboard == approvals.get_approval_keyboard("Abc", 1)
+
+
+def test_other_keyboard_edit_errors_still_raise(lost_race):
+    with pytest.raises(BadRequest):
+        press_reject(BadRequest("Message to edit not found"))
@@ -0,0 +1,49 @@
+import json
+import logging
+import queue
+from unittest import mock
+
+from bot_logging import CONSOLE_FORMAT, StructuredFormatter, TracebackQueueHandler
+from error_handling import log_error
+
+
+def log_exception() -> logging.LogRecord:
+    """Logs an exception through the queue handler and returns the queued record."""
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("test_bot_logging")
+    logger.addHandler(TracebackQueueHandler(log_queue))
+    logger.propagate = False
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Handling %s failed", "update 1")
+    return log_queue.get_nowait()
+
+
+def test_traceback_stays_out_of_the_message():
+    entry = json.loads(StructuredFormatter().format(log_exception()))
+
+    assert entry["message"] == "Handling update 1 failed"
+    assert "ValueError: boom" in entry["traceback"]
+
+
+def test_console_still_shows_the_traceback():
+    line = logging.Formatter(CONSOLE_FORMAT).format(log_exception())
+
+    assert "Handling update 1 failed" in line
+    assert line.rstrip().endswith("ValueError: boom")
+
+
+def test_handler_errors_are_logged_with_their_traceback(caplog):
+    try:
+        raise ValueError("boom")
+    except ValueError as err:
+        error = err
+    context = mock.Mock(error=error)
+
+    with caplog.at_level(logging.ERROR, logger="error_handling"):
+        log_error(None, context)
+
+    entry = json.loads(StructuredFormatter().format(caplog.records[-1]))
+    assert entry["error_type"] == "ValueError"
+    assert "raise ValueError" in entry["traceback"]
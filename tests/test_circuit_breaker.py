@@ -0,0 +1,150 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ServiceUnavailableError,
+)
+
+
+class BackendDown(Exception):
+    """A failure that counts against the backend's health."""
+
+
+class BadRequest(Exception):
+    """An error the backend answered with, which says nothing about its health."""
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+def make_breaker(**settings):
+    settings = {
+        "failure_threshold": 3,
+        "error_rate_threshold": 0.5,
+        "window_size": 4,
+        "reset_timeout": 30,
+        **settings,
+    }
+    return CircuitBreaker(
+        "Backend", lambda err: isinstance(err, BackendDown), **settings
+    )
+
+
+def succeed():
+    return "ok"
+
+
+def fail():
+    raise BackendDown("timed out")
+
+
+def call(breaker, func):
+    """Calls func through the breaker, returning the result or the exception type raised."""
+    try:
+        return breaker.call(func)
+    except Exception as err:
+        return type(err)
+
+
+def test_consecutive_failures_trip_the_breaker(clock):
+    breaker = make_breaker(window_size=100)
+
+    assert [call(breaker, fail) for _ in range(2)] == [ServiceUnavailableError] * 2
+    assert breaker.available
+    assert call(breaker, succeed) == "ok"  # resets the run of failures
+    assert [call(breaker, fail) for _ in range(3)] == [ServiceUnavailableError] * 3
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available
+
+
+def test_the_error_rate_over_the_window_trips_the_breaker(clock):
+    breaker = make_breaker(failure_threshold=100)
+
+    for func in [fail, succeed, succeed, succeed, fail]:
+        call(breaker, func)
+    assert breaker.available  # 1 failure in the last 4 calls
+
+    call(breaker, fail)
+    assert breaker.state == CircuitBreaker.OPEN  # 2 failures in the last 4 calls
+
+
+def test_bad_requests_do_not_count_as_failures(clock):
+    breaker = make_breaker()
+
+    def rejected():
+        raise BadRequest("invalid range")
+
+    assert [call(breaker, rejected) for _ in range(5)] == [BadRequest] * 5
+    assert breaker.available
+
+
+def test_an_open_breaker_fails_fast_until_the_reset_timeout(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, fail)
+    calls = []
+
+    clock.now += 29
+    assert call(breaker, lambda: calls.append(1)) == CircuitOpenError
+    assert calls == []
+    assert issubclass(CircuitOpenError, ServiceUnavailableError)
+
+
+def test_only_one_probe_is_let_through_while_half_open(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, fail)
+    clock.now += 30
+    concurrent = []
+
+    def probe():
+        # Another thread calling while the probe is in flight
+        concurrent.append(call(breaker, succeed))
+        return "ok"
+
+    assert call(breaker, probe) == "ok"
+    assert concurrent == [CircuitOpenError]
+
+
+def test_a_successful_probe_closes_the_breaker(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, fail)
+    clock.now += 30
+
+    assert call(breaker, succeed) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+    # The failures from before the outage no longer count
+    assert [call(breaker, fail) for _ in range(2)] == [ServiceUnavailableError] * 2
+    assert breaker.available
+
+
+def test_a_failed_probe_reopens_the_breaker(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, fail)
+    clock.now += 30
+
+    assert call(breaker, fail) == ServiceUnavailableError
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now += 29  # the reset timeout starts again from the failed probe
+    assert call(breaker, succeed) == CircuitOpenError
+    clock.now += 1
+    assert call(breaker, succeed) == "ok"
+    assert breaker.available
@@ -0,0 +1,124 @@
+from unittest import mock
+
+import pytest
+from telegram.ext import DispatcherHandlerStop
+
+import dedup
+import utils
+from tenants import Tenant, tenant_context
+
+TENANT = Tenant(
+    "test",
+    {
+        "spreadsheet_id": "sheet",
+        "claim_receipt_folder_id": "claims",
+        "payment_proof_folder_id": "proofs",
+    },
+)
+
+RECEIPT_FILE = {"id": "file-1", "size": "1234", "md5Checksum": "abc"}
+
+
+@pytest.fixture
+def processed_updates(monkeypatch):
+    cache = dedup.IdempotencyCache(100)
+    monkeypatch.setattr(dedup, "processed_updates", cache)
+    monkeypatch.setattr(utils, "processed_updates", cache)
+    monkeypatch.setattr(utils, "journal_claim_row", mock.Mock())
+    return cache
+
+
+def make_update():
+    """The same photo message, as Telegram delivers it each time."""
+    update = mock.MagicMock()
+    update.update_id = 42
+    update.effective_chat.id = 100
+    update.effective_message.message_id = 7
+    update.message.photo = [mock.MagicMock()]
+    return update
+
+
+def make_context(user_data):
+    context = mock.MagicMock()
+    context.bot.id = 1
+    context.user_data = user_data
+    return context
+
+
+def deliver(update, context):
+    """Runs the update through the deduplication handler and the photo handler."""
+    dedup.skip_duplicate_updates(update, context)
+    with tenant_context(TENANT):
+        utils.image_handler(update, context)
+
+
+def test_replaying_a_half_processed_claim_resumes_it(processed_updates):
+    conversation = {
+        "waiting_for_receipt": True,
+        "department": "Finance",
+        "name": "jo",
+        "category": "transport",
+        "amount": "12.50",
+        "description": "bus fare",
+    }
+    upload = mock.Mock(return_value=RECEIPT_FILE)
+    append = mock.Mock(side_effect=[RuntimeError("crashed"), 5])
+
+    with mock.patch.object(
+        utils, "send_claim_receipt_to_cloud", upload
+    ), mock.patch.object(utils, "append_claim_row", append):
+        # The receipt is uploaded, then the bot dies before the row is appended
+        with pytest.raises(RuntimeError):
+            deliver(make_update(), make_context(dict(conversation)))
+
+        # Telegram redelivers the message to a bot that has lost the conversation
+        deliver(make_update(), make_context({}))
+
+    upload.assert_called_once()
+    assert append.call_count == 2
+    first_row, replayed_row = (call.args[0] for call in append.call_args_list)
+    assert replayed_row == first_row
+    assert replayed_row[1:3] == ["Finance", "Jo"]
+    assert replayed_row[9:] == ["file-1", "1234", "abc"]
+
+
+def test_replaying_a_completed_message_resends_the_confirmation(processed_updates):
+    conversation = {"waiting_for_receipt": True, "name": "jo"}
+    with mock.patch.object(
+        utils, "send_claim_receipt_to_cloud", return_value=RECEIPT_FILE
+    ), mock.patch.object(utils, "append_claim_row", return_value=5) as append:
+        deliver(make_update(), make_context(dict(conversation)))
+
+        update = make_update()
+        with pytest.raises(DispatcherHandlerStop):
+            deliver(update, make_context({}))
+
+    append.assert_called_once()
+    confirmation = update.message.reply_text.call_args.args[0]
+    assert "Claim Summary" in confirmation
+
+
+def test_replaying_an_appended_claim_does_not_append_it_again(
+    processed_updates, monkeypatch
+):
+    record = processed_updates.record
+
+    def crash_before_completing(key, **results):
+        if "completed" in results:
+            raise RuntimeError("crashed")
+        record(key, **results)
+
+    conversation = {"waiting_for_receipt": True, "name": "jo"}
+    with mock.patch.object(
+        utils, "send_claim_receipt_to_cloud", return_value=RECEIPT_FILE
+    ), mock.patch.object(utils, "append_claim_row", return_value=5) as append:
+        # The row is appended, then the bot dies before finishing the message
+        monkeypatch.setattr(processed_updates, "record", crash_before_completing)
+        with pytest.raises(RuntimeError):
+            deliver(make_update(), make_context(dict(conversation)))
+        monkeypatch.setattr(processed_updates, "record", record)
+
+        deliver(make_update(), make_context({}))
+
+    append.assert_called_once()
+    assert processed_updates.get("message:1:100:7")["appended"] == 5
@@ -0,0 +1,91 @@
+from unittest import mock
+
+import pytest
+
+import drive_connector
+from tenants import Tenant, tenant_context
+
+TENANT = Tenant(
+    "test",
+    {
+        "spreadsheet_id": "sheet",
+        "claim_receipt_folder_id": "claims",
+        "payment_proof_folder_id": "proofs",
+    },
+)
+
+HEADER = [
+    "Claim ID",
+    "Department",
+    "Name",
+    "Date",
+    "Category",
+    "Amount",
+    "Description",
+    "Approval Status",
+    "Receipt",
+]
+
+
+@pytest.fixture
+def sheet_values(monkeypatch):
+    """Makes fetch_sheet read the given values instead of calling Google."""
+    service = mock.MagicMock()
+    monkeypatch.setattr(drive_connector, "get_sheets_service", lambda: service)
+
+    def set_values(values):
+        request = service.spreadsheets().values().get.return_value
+        request.execute.return_value = {"values": values}
+
+    return set_values
+
+
+def test_fetch_sheet_fits_rows_to_the_header(sheet_values):
+    claim_row = ["Abc", "Finance", "Jo", "2024-09-01", "Bus", "$5", "Fare", "Pending"]
+    sheet_values(
+        [
+            HEADER,
+            claim_row + ["Yes", "file-1", "1234", "abc"],  # with the receipt columns
+            ["Def", "Blog", "Al"],  # trailing blank cells are left out
+        ]
+    )
+
+    with tenant_context(TENANT):
+        df = drive_connector.fetch_sheet()
+
+    assert list(df.columns) == HEADER
+    assert df.iloc[0].tolist() == claim_row + ["Yes"]
+    assert df.iloc[1]["Approval Status"] == ""
+    assert drive_connector.get_claim_status(df, "Abc") == {
+        "error": False,
+        "status_msg": "Pending",
+    }
+
+
+def test_fetch_sheet_pages_of_a_sheet_without_claims_yields_the_header(monkeypatch):
+    service = mock.MagicMock()
+    request = service.spreadsheets().values().get.return_value
+    request.execute.side_effect = [{"values": [HEADER]}, {}]
+    monkeypatch.setattr(drive_connector, "get_sheets_service", lambda: service)
+
+    with tenant_context(TENANT):
+        assert list(drive_connector.fetch_sheet_pages(100)) == [(HEADER, [])]
+
+
+def test_a_failing_claim_listener_does_not_fail_the_append(monkeypatch, caplog):
+    service = mock.MagicMock()
+    request = service.spreadsheets().values().append.return_value
+    request.execute.return_value = {
+        "spreadsheetId": "sheet",
+        "updates": {"updatedRange": "Sheet1!A15:L15"},
+    }
+    monkeypatch.setattr(drive_connector, "get_sheets_service", lambda: service)
+    broken = mock.Mock(side_effect=RuntimeError("database is locked"))
+    working = mock.Mock()
+    monkeypatch.setattr(drive_connector, "claim_listeners", [broken, working])
+
+    with tenant_context(TENANT):
+        assert drive_connector.append_claim_row(["Abc"]) == 15
+
+    working.assert_called_once_with(["Abc"], 15)
+    assert "database is locked" in caplog.text
@@ -0,0 +1,70 @@
+import csv
+import gzip
+from decimal import Decimal
+
+import pyarrow.parquet as pq
+
+from export import parse_amount, write_csv_export, write_parquet_export
+
+HEADER = ["Claim ID", "Date", "Amount", "Description"]
+
+
+def test_parse_amount():
+    assert parse_amount("$1,234.5") == Decimal("1234.50")
+    assert parse_amount(" ") is None
+    assert parse_amount("lots") is None
+    assert parse_amount("NaN") is None
+
+
+def test_parquet_export_types_the_columns(tmp_path):
+    path = str(tmp_path / "claims.parquet")
+    pages = [
+        (HEADER, [["Abc", "2024-09-01", "$12.50", "Bus"]]),
+        (HEADER, [["Def", "someday", "", "Lunch"]]),
+    ]
+
+    assert write_parquet_export(pages, path) == 2
+    assert pq.read_table(path).to_pylist()[1] == {
+        "Claim ID": "Def",
+        "Date": None,
+        "Amount": None,
+        "Description": "Lunch",
+    }
+
+
+def test_parquet_export_nulls_amounts_too_large_for_the_column(tmp_path):
+    path = str(tmp_path / "claims.parquet")
+    pages = [
+        (
+            HEADER,
+            [
+                ["Abc", "2024-09-01", "$12345678901.00", "Typo"],
+                ["Def", "2024-09-01", "$9999999999.99", "Largest"],
+            ],
+        )
+    ]
+
+    assert write_parquet_export(pages, path) == 2
+    amounts = pq.read_table(path).column("Amount").to_pylist()
+    assert amounts == [None, Decimal("9999999999.99")]
+
+
+def test_exports_of_a_sheet_without_claims_have_the_header(tmp_path):
+    parquet_path = str(tmp_path / "claims.parquet")
+    csv_path = str(tmp_path / "claims.csv.gz")
+
+    assert write_parquet_export([(HEADER, [])], parquet_path) == 0
+    assert write_csv_export([(HEADER, [])], csv_path) == 0
+
+    table = pq.read_table(parquet_path)
+    assert table.num_rows == 0
+    assert table.column_names == HEADER
+    with gzip.open(csv_path, "rt") as file:
+        assert list(csv.reader(file)) == [HEADER]
+
+
+def test_parquet_export_of_an_empty_sheet_is_still_written(tmp_path):
+    path = str(tmp_path / "claims.parquet")
+
+    assert write_parquet_export([], path) == 0
+    assert pq.read_table(path).num_rows == 0
@@ -0,0 +1,161 @@
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+
+from drive_connector import is_backend_failure
+from google_rest import DriveService, GoogleSession, SheetsService
+from google_stand_in import RECEIPT_BYTES, StandInGoogle
+
+
+@pytest.fixture
+def google():
+    with StandInGoogle() as server:
+        yield server
+
+
+@pytest.fixture
+def session():
+    session = GoogleSession(
+        lambda: SimpleNamespace(valid=True, token="test-token"),
+        timeout=5,
+        connect_timeout=5,
+        max_connections=4,
+    )
+    yield session
+    session.client.close()
+
+
+@pytest.fixture
+def values(google, session):
+    return SheetsService(session, google.endpoint).spreadsheets().values()
+
+
+@pytest.fixture
+def files(google, session):
+    return DriveService(session, google.endpoint).files()
+
+
+def test_values_get(google, values):
+    result = values.get(spreadsheetId="sheet", range="Sheet1!A:M").execute()
+
+    assert result["values"][1] == ["Abc", "Jo"]
+    request = google.requests[-1]
+    assert request["path"] == "/v4/spreadsheets/sheet/values/Sheet1!A:M"
+    assert request["headers"]["Authorization"] == "Bearer test-token"
+    assert "gzip" in request["headers"]["User-Agent"]
+    assert "gzip" in request["headers"]["Accept-Encoding"]
+
+
+def test_values_append(google, values):
+    result = values.append(
+        spreadsheetId="sheet",
+        range="Sheet1!A:M",
+        valueInputOption="RAW",
+        insertDataOption="INSERT_ROWS",
+        body={"values": [["Abc", "Finance"]]},
+    ).execute()
+
+    assert result["updates"]["updatedRange"] == "Sheet1!A15:L15"
+    request = google.requests[-1]
+    assert request["method"] == "POST"
+    assert request["path"] == "/v4/spreadsheets/sheet/values/Sheet1!A:M:append"
+    assert request["query"] == {
+        "valueInputOption": ["RAW"],
+        "insertDataOption": ["INSERT_ROWS"],
+    }
+    assert json.loads(request["body"]) == {"values": [["Abc", "Finance"]]}
+
+
+def test_values_batch_get(google, values):
+    ranges = ["Sheet1!A2:A", "Sheet1!J2:L"]
+    result = values.batchGet(spreadsheetId="sheet", ranges=ranges).execute()
+
+    assert [value_range["range"] for value_range in result["valueRanges"]] == ranges
+    assert google.requests[-1]["query"] == {"ranges": ranges}
+
+
+def test_values_batch_update(google, values):
+    body = {
+        "valueInputOption": "RAW",
+        "data": [{"range": "Sheet1!H2", "values": [["Approved"]]}],
+    }
+    result = values.batchUpdate(spreadsheetId="sheet", body=body).execute()
+
+    assert result == {"totalUpdatedCells": 1}
+    request = google.requests[-1]
+    assert request["path"] == "/v4/spreadsheets/sheet/values:batchUpdate"
+    assert json.loads(request["body"]) == body
+
+
+def test_files_create_multipart(google, files):
+    media = MediaIoBaseUpload(io.BytesIO(RECEIPT_BYTES), mimetype="image/jpeg")
+    result = files.create(
+        body={"name": "abc.jpg", "parents": ["folder"]},
+        media_body=media,
+        fields="id, size, md5Checksum",
+    ).execute()
+
+    assert result == {"id": "file-1", "size": "1234", "md5Checksum": "abc"}
+    request = google.requests[-1]
+    assert request["path"] == "/upload/drive/v3/files"
+    assert request["query"] == {
+        "uploadType": ["multipart"],
+        "fields": ["id, size, md5Checksum"],
+    }
+    content_type = request["headers"]["Content-Type"]
+    assert content_type.startswith("multipart/related; boundary=")
+    boundary = content_type.split("boundary=")[1].encode()
+    metadata_part, media_part = request["body"].split(b"--" + boundary)[1:3]
+    assert b'{"name": "abc.jpg", "parents": ["folder"]}' in metadata_part
+    assert b"Content-Type: image/jpeg" in media_part
+    assert media_part.endswith(RECEIPT_BYTES + b"\r\n")
+
+
+def test_files_list(google, files):
+    result = files.list(
+        q="'folder' in parents", fields="nextPageToken, files(id, name)", pageSize=10
+    ).execute()
+
+    assert result["files"] == [{"id": "file-1", "name": "abc.jpg"}]
+    assert google.requests[-1]["query"] == {
+        "q": ["'folder' in parents"],
+        "fields": ["nextPageToken, files(id, name)"],
+        "pageSize": ["10"],
+    }
+
+
+def test_files_get_media(google, files):
+    assert files.get_media(fileId="file-1").execute() == RECEIPT_BYTES
+    request = google.requests[-1]
+    assert request["path"] == "/drive/v3/files/file-1"
+    assert request["query"] == {"alt": ["media"]}
+
+
+@pytest.mark.parametrize(
+    "status, backend_failure", [(503, True), (429, True), (400, False)]
+)
+def test_error_responses_raise_http_error(session, status, backend_failure):
+    def respond(request):
+        return status, {"error": {"code": status, "message": "stand-in failure"}}
+
+    with StandInGoogle(respond) as google:
+        request = DriveService(session, google.endpoint).files().list(q="x")
+        with pytest.raises(HttpError) as raised:
+            request.execute()
+
+    assert raised.value.resp.status == status
+    assert "stand-in failure" in str(raised.value)
+    assert is_backend_failure(raised.value) is backend_failure
+
+
+def test_connections_are_reused(google, values, files):
+    for _ in range(10):
+        values.get(spreadsheetId="sheet", range="Sheet1!A:M").execute()
+        files.get_media(fileId="file-1").execute()
+
+    assert len(google.requests) == 20
+    assert len(google.connections) == 1
@@ -0,0 +1,15 @@
+from unittest import mock
+
+import receipts
+
+
+def test_unknown_claim_ids_are_escaped_for_markdown(monkeypatch):
+    monkeypatch.setattr(receipts, "is_admin", lambda update: True)
+    monkeypatch.setattr(receipts, "get_receipt", lambda claim_id: None)
+    update = mock.MagicMock()
+
+    receipts.receipt_command(update, mock.Mock(args=["jo_doe_*8f14e45f"]))
+
+    reply = update.message.reply_text.call_args
+    assert "claim ID 'jo\\_doe\\_\\*8f14e45f'" in reply.args[0]
+    assert reply.kwargs["parse_mode"] == "Markdown"
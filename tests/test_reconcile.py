@@ -0,0 +1,182 @@
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+from telegram.error import Unauthorized
+
+import reconcile
+from circuit_breaker import ServiceUnavailableError
+from claim_store import journal_claim_row, record_claim_row
+from submission_queue import queue_submission
+from tenants import Tenant, tenant_context
+
+OLD = "2024-09-01T10:00:00.000Z"
+
+
+def make_tenant(name, tmp_path, monkeypatch):
+    """A tenant keeping its claim store, checkpoint and queue under tmp_path."""
+    tenant = Tenant(
+        name,
+        {
+            "spreadsheet_id": f"{name}-sheet",
+            "claim_receipt_folder_id": f"{name}-claims",
+            "payment_proof_folder_id": f"{name}-proofs",
+            "admin_user_ids": [900, 901],
+        },
+    )
+    directory = tmp_path / name
+    directory.mkdir()
+    monkeypatch.setattr(tenant, "path", lambda filename: str(directory / filename))
+    return tenant
+
+
+@pytest.fixture
+def tenant(tmp_path, monkeypatch):
+    tenant = make_tenant("test", tmp_path, monkeypatch)
+    with tenant_context(tenant):
+        yield tenant
+
+
+def recently():
+    """A Drive createdTime within the orphan grace period."""
+    created = datetime.now(timezone.utc) - timedelta(minutes=1)
+    return created.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def drive_file(claim_id, created_time=OLD):
+    return {
+        "id": f"file-{claim_id}",
+        "name": f"{claim_id}.jpg",
+        "createdTime": created_time,
+    }
+
+
+def claim_row(claim_id):
+    return [claim_id.capitalize(), "Finance", "Jo", "2024-09-01", "Bus", "$5", "Fare"]
+
+
+@pytest.fixture
+def google(monkeypatch):
+    """Stands in for the Drive listing and the sheet's Claim ID column."""
+    google = mock.Mock()
+    google.files = []
+    google.claim_ids = []
+
+    def list_folder_files(folder_id, fields, query=None):
+        google.queries.append(query)
+        yield google.files
+
+    def batch_get_ranges(ranges):
+        google.ranges.append(ranges[0])
+        first_row = int(ranges[0].split("!A")[1].split(":")[0])
+        return [[[claim_id] for claim_id in google.claim_ids[first_row - 2 :]]]
+
+    google.queries = []
+    google.ranges = []
+    monkeypatch.setattr(reconcile, "list_folder_files", list_folder_files)
+    monkeypatch.setattr(reconcile, "batch_get_ranges", batch_get_ranges)
+    monkeypatch.setattr(reconcile, "append_claim_row", google.append_claim_row)
+    return google
+
+
+def test_find_mismatches(tenant, google):
+    google.files = [
+        drive_file("abc"),  # has a row
+        drive_file("def"),  # orphan
+        drive_file("ghi", recently()),  # may still be getting its row
+    ]
+    google.claim_ids = ["Abc", "Xyz"]  # Xyz has no receipt
+    journal_claim_row(claim_row("jkl"))  # built, but never appended
+
+    report = reconcile.reconcile()
+
+    assert report["orphans"] == [("def", "file-def")]
+    assert report["dangling"] == [("xyz", 3)]
+    assert report["new_files"] == 3
+    assert report["new_rows"] == 2
+
+
+def test_the_checkpoint_advances_between_runs(tenant, google):
+    google.files = [
+        drive_file("abc", OLD),
+        drive_file("def", "2024-09-02T08:00:00.000Z"),
+    ]
+    google.claim_ids = ["Abc", "Def"]
+    reconcile.reconcile()
+
+    with open(tenant.path(reconcile.CHECKPOINT_PATH)) as file:
+        assert json.load(file) == {
+            "drive_created_after": "2024-09-02T08:00:00.000Z",
+            "sheet_rows_seen": 2,
+        }
+
+    google.files = [drive_file("ghi", "2024-09-03T08:00:00.000Z")]
+    google.claim_ids.append("Ghi")
+    report = reconcile.reconcile()
+
+    assert google.queries == [None, "createdTime >= '2024-09-02T08:00:00.000Z'"]
+    assert google.ranges == ["Sheet1!A2:A", "Sheet1!A4:A"]
+    assert (report["new_files"], report["new_rows"]) == (1, 1)
+    assert report["orphans"] == report["dangling"] == []
+
+
+def test_a_full_run_starts_again(tenant, google):
+    google.files = [drive_file("abc")]
+    google.claim_ids = ["Abc"]
+    reconcile.reconcile()
+
+    google.files = []  # the receipt was deleted from Drive
+    report = reconcile.reconcile(full=True)
+
+    assert google.queries == [None, None]
+    assert report["dangling"] == [("abc", 2)]
+
+
+def test_repair_skips_claims_still_queued(tenant, google):
+    google.files = [drive_file("abc"), drive_file("def")]
+    for claim_id in ["abc", "def"]:
+        journal_claim_row(claim_row(claim_id) + ["Pending", "Yes", "file-1", "1", "x"])
+    queue_submission(100, "Def", "test-claims", claim_row("def"))
+
+    def append(row):
+        record_claim_row(row, 2)
+        google.claim_ids.append(row[0])
+
+    google.append_claim_row.side_effect = append
+    report = reconcile.reconcile(repair=True)
+
+    google.append_claim_row.assert_called_once()
+    assert google.append_claim_row.call_args.args[0][0] == "Abc"
+    assert report["repaired"] == ["abc"]
+    assert report["orphans"] == [("def", "file-def")]
+
+
+def test_nightly_reconciliation_carries_on_after_a_failing_tenant(
+    tmp_path, monkeypatch
+):
+    tenants = [make_tenant(name, tmp_path, monkeypatch) for name in ["down", "up"]]
+    monkeypatch.setattr(reconcile.tenant_registry, "all", lambda: tenants)
+    bot = mock.Mock()
+    bot.send_message.side_effect = [Unauthorized("bot was blocked by the user"), None]
+    monkeypatch.setattr(reconcile.tenant_registry, "get_bot", lambda tenant: bot)
+    monkeypatch.setattr(reconcile, "get_admin_ids", lambda tenant: [900, 901])
+
+    def reconcile_tenant(repair):
+        if reconcile.get_current_tenant() is tenants[0]:
+            raise ServiceUnavailableError("Google Sheets is unavailable")
+        return {
+            "new_files": 1,
+            "new_rows": 0,
+            "orphans": [("abc", "file-abc")],
+            "dangling": [],
+            "repaired": [],
+        }
+
+    monkeypatch.setattr(reconcile, "reconcile", reconcile_tenant)
+    reconcile.nightly_reconciliation(mock.Mock())
+
+    assert [call.kwargs["chat_id"] for call in bot.send_message.call_args_list] == [
+        900,
+        901,
+    ]
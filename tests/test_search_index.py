@@ -0,0 +1,137 @@
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+import search_index
+from search_index import ClaimSearchIndex, format_search_result, parse_search_args
+
+HEADER = ["Claim ID", "Department", "Name", "Date", "Category", "Amount", "Description"]
+
+CLAIMS = [
+    ["A1", "Publicity", "Jo", "2024-09-01", "Posters", "$10.00", "Bus to the printer"],
+    ["A2", "Logistics", "Sam", "2024-09-05", "Bus", "$25.50", "Bus to Pokhara"],
+    ["A3", "Finance", "Bus Driver", "2024-09-10", "Food", "$100.00", "Lunch"],
+    ["A4", "Blog", "Al", "not a date", "Bus", "free", "Bus back"],
+]
+
+
+@pytest.fixture
+def index():
+    index = ClaimSearchIndex()
+    index.load([(HEADER, CLAIMS[:2]), (HEADER, CLAIMS[2:])])
+    return index
+
+
+def claim_ids(claims):
+    return [claim["Claim ID"] for claim in claims]
+
+
+def test_search_results_escape_user_text():
+    claim = dict(
+        zip(HEADER, ["Abc", "Finance", "Jo_b", "2024-09-01", "bus_fare", "12", "a*b"])
+    )
+
+    assert format_search_result(claim) == (
+        "`Abc` | 2024-09-01 | bus\\_fare | 12 | Jo\\_b\n    a\\*b"
+    )
+
+
+def test_index_goes_stale():
+    index = ClaimSearchIndex()
+    assert index.is_stale(60)
+
+    index.load([(HEADER, [["Abc", "Finance", "Jo", "2024-09-01", "Bus", "12", "x"]])])
+    assert not index.is_stale(60)
+    assert index.is_stale(-1)
+
+
+def test_terms_are_intersected_newest_first(index):
+    assert claim_ids(index.search(["bus"])) == ["A4", "A3", "A2", "A1"]
+    assert claim_ids(index.search(["bus", "pokhara"])) == ["A2"]
+    assert claim_ids(index.search(["bus", "nowhere"])) == []
+
+
+def test_terms_can_be_limited_to_a_column(index):
+    assert claim_ids(index.search(["category:bus"])) == ["A4", "A2"]
+    assert claim_ids(index.search(["name:bus"])) == ["A3"]
+    assert claim_ids(index.search(["Category:BUS", "description:back"])) == ["A4"]
+
+
+def test_date_ranges_include_both_ends(index):
+    found = index.search([], date_from=date(2024, 9, 1), date_to=date(2024, 9, 5))
+    assert claim_ids(found) == ["A2", "A1"]
+    assert claim_ids(index.search([], date_from=date(2024, 9, 2))) == ["A3", "A2"]
+    assert claim_ids(index.search([], date_to=date(2024, 8, 31))) == []
+
+
+def test_amount_ranges_combine_with_terms(index):
+    assert claim_ids(index.search([], min_amount=Decimal("25.50"))) == ["A3", "A2"]
+    assert claim_ids(index.search([], max_amount=Decimal("25.50"))) == ["A2", "A1"]
+    found = index.search(["bus"], min_amount=Decimal("20"), max_amount=Decimal("200"))
+    assert claim_ids(found) == ["A3", "A2"]
+
+
+def test_added_rows_are_searchable_once_loaded():
+    index = ClaimSearchIndex()
+    index.add_row(CLAIMS[0])
+    assert index.search(["printer"]) == []  # ignored until the index is loaded
+
+    index.load([(HEADER, CLAIMS[1:2])])
+    index.add_row(["A5", "Blog", "Kim", "2024-09-03", "Bus", "$30", "Bus to Lukla"])
+    index.add_row(CLAIMS[1])  # already indexed
+
+    assert claim_ids(index.search(["bus"])) == ["A5", "A2"]
+    found = index.search([], date_from=date(2024, 9, 2), max_amount=Decimal("30"))
+    assert claim_ids(found) == ["A5", "A2"]
+
+
+def test_parse_search_args():
+    assert parse_search_args(["bus", "from:2024-09-01", "max:$20", "page:2"]) == {
+        "terms": ["bus"],
+        "date_from": date(2024, 9, 1),
+        "date_to": None,
+        "min_amount": None,
+        "max_amount": Decimal("20.00"),
+        "page": 2,
+    }
+
+
+@pytest.mark.parametrize("arg", ["from:2024-13-45", "to:yesterday", "min:ten", "max:$"])
+def test_invalid_filters_are_rejected(arg):
+    with pytest.raises(ValueError):
+        parse_search_args(["bus", arg])
+
+
+def search(index, monkeypatch, *args):
+    """Runs /search with the given arguments and returns the reply."""
+    monkeypatch.setattr(search_index, "is_admin", lambda update: True)
+    monkeypatch.setattr(search_index, "get_claim_index", lambda: index)
+    update = mock.MagicMock()
+    search_index.search_command(update, mock.Mock(args=list(args)))
+    return update.message.reply_text.call_args.args[0]
+
+
+def test_search_command_rejects_invalid_filters(index, monkeypatch):
+    reply = search(index, monkeypatch, "from:2024-13-45", "bus")
+
+    assert reply.startswith("⚠️ Invalid from filter: 2024-13-45")
+    assert "Usage: /search" in reply
+
+
+def test_search_command_pages_the_results(index, monkeypatch):
+    monkeypatch.setattr(search_index, "SEARCH_RESULTS_PER_PAGE", 3)
+
+    first_page = search(index, monkeypatch, "bus")
+    last_page = search(index, monkeypatch, "bus", "page:9")
+
+    assert "*4 claims found*" in first_page
+    assert "page 1/2" in first_page
+    assert ["`A4`", "`A3`", "`A2`"] == [
+        line.split(" | ")[0] for line in first_page.split("\n\n")[1].splitlines()[::2]
+    ]
+    assert first_page.endswith("Add `page:2` to see more results.")
+    assert "page 2/2" in last_page
+    assert "`A1`" in last_page
+    assert "page:3" not in last_page
@@ -0,0 +1,107 @@
+import json
+import os
+from unittest import mock
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import submission_queue
+from tenants import Tenant, tenant_context
+
+TENANT = Tenant(
+    "test",
+    {
+        "spreadsheet_id": "sheet",
+        "claim_receipt_folder_id": "claims",
+        "payment_proof_folder_id": "proofs",
+    },
+)
+
+RECEIPT_BYTES = b"\xff\xd8\xff\xe0 not really a jpeg"
+
+
+@pytest.fixture
+def queue_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(submission_queue, "get_queue_directory", lambda: str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize("name", ["John/Doe", "../../x", "jo_abc123"])
+def test_queue_files_are_named_from_a_generated_id(queue_directory, name):
+    receipt_name = f"{name}_8f14e45f-ceea-467f-a0e6-0c5a2a2bd"
+    submission_queue.queue_submission(
+        100, receipt_name, "proofs", receipt_bytes=RECEIPT_BYTES
+    )
+
+    (json_path,) = submission_queue.list_queued_submissions()
+    assert os.path.dirname(json_path) == str(queue_directory)
+    assert sorted(os.listdir(queue_directory)) == [
+        os.path.basename(json_path)[: -len(".json")] + extension
+        for extension in [".jpg", ".json"]
+    ]
+    with open(json_path) as file:
+        assert json.load(file)["receipt_name"] == receipt_name
+    assert submission_queue.queued_receipt_names() == {receipt_name.lower()}
+
+
+def test_completing_a_queued_proof_uploads_its_receipt(queue_directory):
+    submission_queue.queue_submission(
+        100, "John/Doe_abc", "proofs", receipt_bytes=RECEIPT_BYTES
+    )
+    (path,) = submission_queue.list_queued_submissions()
+
+    with mock.patch.object(submission_queue, "upload_receipt") as upload:
+        item = submission_queue.complete_queued_submission(path)
+
+    upload.assert_called_once_with("John/Doe_abc", RECEIPT_BYTES, "proofs")
+    assert item["receipt_uploaded"]
+    assert os.listdir(queue_directory) == []
+
+
+def rejected(*args, **kwargs):
+    raise HttpError(httplib2.Response({"status": 400}), b"Invalid request")
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    bot = mock.Mock()
+    monkeypatch.setattr(submission_queue.tenant_registry, "get_bot", lambda t: bot)
+    monkeypatch.setattr(submission_queue, "get_admin_ids", lambda tenant: [900])
+    return bot
+
+
+def drain():
+    with tenant_context(TENANT):
+        submission_queue.drain_submission_queue(mock.Mock())
+
+
+def test_a_rejected_upload_is_kept_for_the_finance_team(queue_directory, bot):
+    submission_queue.queue_submission(
+        100, "Abc", "claims", ["Abc", "Finance"], receipt_bytes=RECEIPT_BYTES
+    )
+
+    with mock.patch.object(submission_queue, "upload_receipt", rejected):
+        drain()
+
+    assert submission_queue.list_queued_submissions() == []
+    failed = sorted(os.listdir(queue_directory / "failed"))
+    assert [os.path.splitext(name)[1] for name in failed] == [".jpg", ".json"]
+    user_message, admin_message = (
+        call.kwargs for call in bot.send_message.call_args_list
+    )
+    assert user_message["chat_id"] == 100
+    assert "could not save your submission Abc" in user_message["text"]
+    assert admin_message["chat_id"] == 900
+
+
+def test_a_rejected_append_is_left_to_reconciliation(queue_directory, bot):
+    submission_queue.queue_submission(100, "Abc", "claims", ["Abc", "Finance"])
+
+    with mock.patch.object(submission_queue, "append_claim_row", rejected):
+        drain()
+
+    assert os.listdir(queue_directory) == []
+    bot.send_message.assert_called_once()
+    assert bot.send_message.call_args.kwargs["chat_id"] == 100
+    assert "no need to resubmit" in bot.send_message.call_args.kwargs["text"]
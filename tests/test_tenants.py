@@ -0,0 +1,101 @@
+import os
+import logging
+
+import yaml
+
+from tenants import TenantRegistry
+
+TRIP = {
+    "spreadsheet_id": "sheet-1",
+    "claim_receipt_folder_id": "claims",
+    "payment_proof_folder_id": "proofs",
+}
+
+
+def write_tenants(path, tenants, mtime):
+    path.write_text(yaml.safe_dump({"tenants": tenants}))
+    os.utime(path, (mtime, mtime))
+
+
+def test_the_default_name_is_reserved(tmp_path, caplog):
+    path = tmp_path / "tenants.yaml"
+    write_tenants(path, {"default": TRIP, "everest": TRIP}, 1)
+
+    registry = TenantRegistry(str(path))
+
+    assert [tenant.name for tenant in registry.all()] == ["default", "everest"]
+    assert registry.all()[0].is_default
+    assert "name is reserved" in caplog.text
+
+
+def test_missing_bot_token_is_logged(tmp_path, caplog):
+    path = tmp_path / "tenants.yaml"
+    write_tenants(path, {"everest": {**TRIP, "bot_token_env": "NO_SUCH_TOKEN"}}, 1)
+
+    with caplog.at_level(logging.ERROR):
+        registry = TenantRegistry(str(path))
+
+    assert registry.get("everest").bot_token == ""
+    assert "NO_SUCH_TOKEN is not set" in caplog.text
+
+
+def test_reload_reports_changed_and_removed_spreadsheets(tmp_path):
+    path = tmp_path / "tenants.yaml"
+    write_tenants(path, {"everest": TRIP, "annapurna": TRIP, "langtang": TRIP}, 1)
+    registry = TenantRegistry(str(path))
+    forgotten = []
+    registry.add_reload_listener(forgotten.append)
+
+    write_tenants(
+        path,
+        {"everest": {**TRIP, "spreadsheet_id": "sheet-2"}, "langtang": TRIP},
+        2,
+    )
+
+    assert registry.reload_if_changed()
+    assert sorted(forgotten) == ["annapurna", "everest"]
+    assert registry.get("everest").spreadsheet_id == "sheet-2"
+
+
+def test_tenants_with_missing_settings_are_skipped(tmp_path, caplog):
+    path = tmp_path / "tenants.yaml"
+    incomplete = {key: value for key, value in TRIP.items() if key != "spreadsheet_id"}
+    write_tenants(path, {"everest": incomplete, "langtang": TRIP, "bad": "x"}, 1)
+
+    registry = TenantRegistry(str(path))
+
+    assert registry.get("everest") is None
+    assert registry.get("bad") is None
+    assert registry.get("langtang").spreadsheet_id == "sheet-1"
+    assert "Ignoring the tenant everest, it has no spreadsheet_id" in caplog.text
+
+
+def test_a_broken_edit_keeps_the_previous_settings(tmp_path, caplog):
+    path = tmp_path / "tenants.yaml"
+    write_tenants(path, {"everest": TRIP, "langtang": TRIP}, 1)
+    registry = TenantRegistry(str(path))
+    forgotten = []
+    registry.add_reload_listener(forgotten.append)
+
+    write_tenants(path, {"everest": {**TRIP, "spreadsheet_id": None}}, 2)
+    assert registry.reload_if_changed()
+
+    assert registry.get("everest").spreadsheet_id == "sheet-1"
+    assert registry.get("langtang") is None
+    assert forgotten == ["langtang"]
+    assert "Keeping the previous settings of tenant everest" in caplog.text
+
+
+def test_an_unreadable_tenants_file_keeps_the_current_tenants(tmp_path, caplog):
+    path = tmp_path / "tenants.yaml"
+    write_tenants(path, {"everest": TRIP}, 1)
+    registry = TenantRegistry(str(path))
+
+    for mtime, content in [(2, "tenants: [everest"), (3, "tenants: [everest]")]:
+        path.write_text(content)
+        os.utime(path, (mtime, mtime))
+        assert not registry.reload_if_changed()
+        assert registry.get("everest").spreadsheet_id == "sheet-1"
+
+    assert "Could not read" in caplog.text
+    assert not registry.reload_if_changed()  # not retried until the file changes
@@ -0,0 +1,54 @@
+from datetime import datetime
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+import utils
+from circuit_breaker import CircuitOpenError
+
+SNAPSHOT = pd.DataFrame(
+    [["Abc", "Approved"], ["Def", "Pending"]], columns=["Claim ID", "Approval Status"]
+)
+
+
+@pytest.fixture
+def sheets_down(monkeypatch):
+    def fetch_sheet():
+        raise CircuitOpenError("Google Sheets is temporarily unavailable")
+
+    monkeypatch.setattr(utils, "fetch_sheet", fetch_sheet)
+
+
+def check_status(claim_id):
+    update = mock.MagicMock()
+    context = mock.Mock(user_data={"waiting_for_claim_id": True})
+    utils.handle_claim_status_check(update, context, claim_id)
+    return update.message.reply_text.call_args.args[0]
+
+
+def test_status_checks_fall_back_to_the_snapshot(sheets_down, monkeypatch):
+    fetched_at = datetime(2024, 9, 1, 14, 30)
+    monkeypatch.setattr(utils, "get_sheet_snapshot", lambda: (SNAPSHOT, fetched_at))
+
+    reply = check_status("Abc")
+
+    assert "has been *approved*" in reply
+    assert reply.endswith("so this status is as of 01 Sep 2024 14:30._")
+
+
+def test_status_checks_without_a_snapshot_say_sheets_is_down(sheets_down, monkeypatch):
+    monkeypatch.setattr(utils, "get_sheet_snapshot", lambda: (None, None))
+
+    reply = check_status("Abc")
+
+    assert reply.startswith("⚠️ Sorry, we cannot reach Google Sheets right now.")
+
+
+def test_fresh_status_checks_have_no_note(monkeypatch):
+    monkeypatch.setattr(utils, "fetch_sheet", lambda: SNAPSHOT)
+
+    reply = check_status("Def")
+
+    assert "is still being processed" in reply
+    assert "as of" not in reply
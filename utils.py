@@ -1,52 +1,44 @@
 import uuid
 import re
+import logging
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import CallbackContext
+from googleapiclient.errors import HttpError
 
 from drive_connector import *
 from error_handling import *
+from error_handling import (
+    notify_claim_pending_reconciliation,
+    notify_service_unavailable,
+    notify_submission_queued,
+)
+from keyboards import create_reply_keyboard, get_main_menu_keyboard
+from circuit_breaker import ServiceUnavailableError
+from submission_queue import queue_submission
+from claim_store import journal_claim_row
+from dedup import get_message_key, processed_updates
+from tenants import get_current_tenant
 
+logger = logging.getLogger(__name__)
 
-def create_reply_keyboard(
-    options: list[str], rows: int, columns: int, placeholder: str = None
-) -> ReplyKeyboardMarkup:
-    """
-    Generates a dynamic reply keyboard for the user based on the provided shape (rows and columns).
-    """
-    # Create the keyboard layout based on the given rows and columns
-    keyboard_layout = [
-        options[i : i + columns] for i in range(0, len(options), columns)
-    ]
-
-    return ReplyKeyboardMarkup(
-        keyboard_layout,
-        one_time_keyboard=True,
-        input_field_placeholder=placeholder,
-        selective=True,  # Ensures only the user sees the keyboard
-    )
+# Conversation answers a claim row is built from
+CLAIM_DETAIL_FIELDS = ["department", "name", "category", "amount", "description"]
 
 
-def get_main_menu_keyboard(rows: int, columns: int) -> ReplyKeyboardMarkup:
-    """Generates the main menu reply keyboard for the user with custom rows and columns."""
-    options = ["Submit a Claim", "Check Claim Status", "Submit Proof of Payment"]
+def get_department_keyboard(rows: int, columns: int) -> ReplyKeyboardMarkup:
+    """Creates a dynamic reply keyboard for selecting one of the trip's departments."""
     return create_reply_keyboard(
-        options, rows, columns, placeholder="Select one of the options below"
+        get_current_tenant().departments,
+        rows,
+        columns,
+        placeholder="Select your department",
     )
 
 
-def get_department_keyboard(rows: int, columns: int) -> ReplyKeyboardMarkup:
-    """Creates a dynamic reply keyboard for department selection."""
-    options = [
-        "Logistics",
-        "Finance",
-        "First Aid",
-        "Blog",
-        "Publicity",
-        "Flights & Accoms",
-    ]
-    return create_reply_keyboard(
-        options, rows, columns, placeholder="Select your department"
-    )
+def is_admin(update: Update) -> bool:
+    """Checks if the user is a member of the current trip's finance team admin list."""
+    admin_ids = get_admin_ids(get_current_tenant())
+    return update.effective_user is not None and update.effective_user.id in admin_ids
 
 
 def generate_uuid() -> str:
@@ -59,17 +51,8 @@ def handle_department_input(
 ) -> None:
     """Handles user input for the department during claim submission."""
 
-    valid_departments = [
-        "Logistics",
-        "Flights & Accoms",
-        "First Aid",
-        "Finance",
-        "Blog",
-        "Publicity",
-    ]
-
     # If user hasn't selected yet, show the keyboard
-    if user_response not in valid_departments:
+    if user_response not in get_current_tenant().departments:
         reply_markup = get_department_keyboard(2, 3)
         update.message.reply_text(
             "Please choose your department:", reply_markup=reply_markup
@@ -185,8 +168,23 @@ def handle_claim_status_check(
     update: Update, context: CallbackContext, claim_id: str
 ) -> None:
     """Fetches claim status based on the claim ID provided by the user."""
-    data = fetch_sheet()
+    try:
+        data = fetch_sheet()
+        as_of = None
+    except ServiceUnavailableError:
+        # Degraded mode: answer from the last sheet we managed to fetch
+        data, as_of = get_sheet_snapshot()
+        if data is None:
+            notify_service_unavailable(update)
+            context.user_data.clear()
+            return
+
     status = get_claim_status(data, claim_id)
+    stale_note = (
+        f"\n\n_Google Sheets is currently unavailable, so this status is as of {as_of:%d %b %Y %H:%M}._"
+        if as_of is not None
+        else ""
+    )
 
     if status["error"]:
         handle_invalid_claim_id(update, context, status)
@@ -196,14 +194,14 @@ def handle_claim_status_check(
         if answer in ["approved", "rejected"]:
             # Format the message for approved or rejected claims
             update.message.reply_text(
-                f"✅ *Status Update* \n\nYour claim (ID: `{claim_id}`) has been *{answer}*.\n\nThank you for your patience!",
+                f"✅ *Status Update* \n\nYour claim (ID: `{claim_id}`) has been *{answer}*.\n\nThank you for your patience!{stale_note}",
                 reply_markup=get_main_menu_keyboard(3, 2),
                 parse_mode="Markdown",
             )
         else:
             # Format the message for claims still in process
             update.message.reply_text(
-                f"⌛ *Processing Update* \n\nThe Claim ID: `{claim_id}` is still being processed.\n\nPlease check back later for an update. We appreciate your understanding!",
+                f"⌛ *Processing Update* \n\nThe Claim ID: `{claim_id}` is still being processed.\n\nPlease check back later for an update. We appreciate your understanding!{stale_note}",
                 reply_markup=get_main_menu_keyboard(3, 2),
                 parse_mode="Markdown",
             )
@@ -211,8 +209,8 @@ def handle_claim_status_check(
     context.user_data.clear()
 
 
-def send_user_claim_confirmation(update: Update, context: CallbackContext) -> None:
-    """Sends a confirmation message with the claim summary."""
+def send_user_claim_confirmation(update: Update, context: CallbackContext) -> str:
+    """Sends a confirmation message with the claim summary and returns its text."""
     department = context.user_data.get("department", "").capitalize()
     name = context.user_data.get("name", "").capitalize()
     category = context.user_data.get("category", "").capitalize()
@@ -239,17 +237,28 @@ def send_user_claim_confirmation(update: Update, context: CallbackContext) -> No
         reply_markup=get_main_menu_keyboard(3, 2),
         parse_mode="Markdown",
     )
+    return confirmation_message
 
 
 def image_handler(update: Update, context: CallbackContext) -> None:
     """
     Handles the receipt image sent by the user.
     """
-    if context.user_data.get("waiting_for_receipt"):
+    # A redelivered message that was only partly processed resumes the submission it started
+    submission = processed_updates.get(get_message_key(update, context)).get(
+        "submission"
+    )
+
+    if submission == "claim" or (
+        submission is None and context.user_data.get("waiting_for_receipt")
+    ):
         handle_receipt_submission(update, context)
         context.user_data["waiting_for_receipt"] = False
 
-    elif context.user_data.get("waiting_for_payment_proof_receipt"):
+    elif submission == "payment_proof" or (
+        submission is None
+        and context.user_data.get("waiting_for_payment_proof_receipt")
+    ):
         handle_payment_proof_submission(update, context)
         context.user_data["waiting_for_payment_proof_receipt"] = False
 
@@ -259,25 +268,78 @@ def handle_receipt_submission(update: Update, context: CallbackContext) -> None:
     if update.message.photo:
         photo_file = update.message.photo[-1].get_file()
         context.user_data["image"] = photo_file
-        receipt_path = f"{generate_uuid()}"
+
+        # Each step records its result under the message's idempotency key,
+        # so processing the same message again skips the steps already done
+        key = get_message_key(update, context)
+        steps = processed_updates.get(key)
+        receipt_path = steps.get("receipt_path") or f"{generate_uuid()}"
+        # Keep the claim details too, as the conversation is gone after a crash
+        details = steps.get("details") or {
+            field: context.user_data.get(field, "") for field in CLAIM_DETAIL_FIELDS
+        }
+        context.user_data.update(details)
+        processed_updates.record(
+            key, submission="claim", receipt_path=receipt_path, details=details
+        )
 
         try:
             # Send the receipt to Google Drive
-            send_claim_receipt_to_cloud(receipt_path, photo_file)
+            receipt_bytes = None
+            if "receipt_file" in steps:
+                receipt_file = steps["receipt_file"]
+            else:
+                try:
+                    receipt_file = send_claim_receipt_to_cloud(receipt_path, photo_file)
+                    processed_updates.record(key, receipt_file=receipt_file)
+                except ServiceUnavailableError:
+                    # Drive is down, keep the receipt locally until it recovers
+                    receipt_file = None
+                    receipt_bytes = bytes(photo_file.download_as_bytearray())
 
             # Store the UUID for reference and send confirmation
             context.user_data["receipt_uuid"] = receipt_path
             update.message.reply_text("Image received!")
-            send_user_claim_confirmation(update, context)
-
-            # Export claim details to Google Drive
-            export_claim_details(context)
+            confirmation = send_user_claim_confirmation(update, context)
+            processed_updates.record(key, confirmation=confirmation)
+
+            # Journal the row first so the reconciliation job can recover it if the append is lost
+            new_row = build_claim_row(context.user_data, receipt_file)
+            journal_claim_row(new_row)
+
+            # Export claim details to Google Drive, or queue them while Google is down
+            chat_id = update.effective_chat.id
+            folder_id = get_current_tenant().claim_receipt_folder_id
+            if "appended" in steps or "queued" in steps:
+                pass
+            elif receipt_bytes is not None:
+                queue_submission(
+                    chat_id, receipt_path, folder_id, new_row, receipt_bytes
+                )
+                processed_updates.record(key, queued=True)
+                notify_submission_queued(update)
+            else:
+                try:
+                    row_number = append_claim_row(new_row)
+                    processed_updates.record(key, appended=row_number)
+                except ServiceUnavailableError:
+                    queue_submission(chat_id, receipt_path, folder_id, new_row)
+                    processed_updates.record(key, queued=True)
+                    notify_submission_queued(update)
+                except HttpError as err:
+                    logger.error(
+                        "Appending claim %s was rejected: %s", receipt_path, err
+                    )
+                    notify_claim_pending_reconciliation(update)
         except ValueError:
             handle_invalid_image(update)
+        finally:
+            context.user_data.clear()
+        processed_updates.record(key, completed=True)
     else:
         # If no photo is provided, ask for a valid photo
         request_valid_image(update)
-    context.user_data.clear()
+        context.user_data.clear()
 
 
 def initiate_payment_proof_submission(update: Update, context: CallbackContext) -> None:
@@ -304,8 +366,8 @@ def handle_payment_proof_name_input(
 
 def send_user_payment_proof_confirmation(
     update: Update, context: CallbackContext
-) -> None:
-    """Sends a confirmation message with the submission summary."""
+) -> str:
+    """Sends a confirmation message with the submission summary and returns its text."""
     name = context.user_data.get("name", "").capitalize()
     receipt_id = context.user_data.get("receipt_uuid", "").capitalize()
 
@@ -325,6 +387,7 @@ def send_user_payment_proof_confirmation(
         parse_mode="Markdown",
     )
     context.user_data.clear()
+    return confirmation_message
 
 
 def handle_payment_proof_submission(update: Update, context: CallbackContext) -> None:
@@ -332,19 +395,47 @@ def handle_payment_proof_submission(update: Update, context: CallbackContext) ->
     if update.message.photo:
         photo_file = update.message.photo[-1].get_file()
         context.user_data["image"] = photo_file
-        name = context.user_data["name"]
-        receipt_path = f"{name}_{generate_uuid()}"
+
+        # Reuse the earlier results if this message was already partly processed
+        key = get_message_key(update, context)
+        steps = processed_updates.get(key)
+        name = steps.get("details", {}).get("name") or context.user_data["name"]
+        context.user_data["name"] = name
+        receipt_path = steps.get("receipt_path") or f"{name}_{generate_uuid()}"
+        processed_updates.record(
+            key,
+            submission="payment_proof",
+            receipt_path=receipt_path,
+            details={"name": name},
+        )
         try:
             # Send the receipt to Google Drive
-            send_payment_proof_to_cloud(receipt_path, photo_file)
+            queued = False
+            if not steps.get("uploaded"):
+                try:
+                    send_payment_proof_to_cloud(receipt_path, photo_file)
+                except ServiceUnavailableError:
+                    # Drive is down, keep the proof locally until it recovers
+                    queue_submission(
+                        update.effective_chat.id,
+                        receipt_path,
+                        get_current_tenant().payment_proof_folder_id,
+                        receipt_bytes=bytes(photo_file.download_as_bytearray()),
+                    )
+                    queued = True
+                processed_updates.record(key, uploaded=True)
 
             # Store the UUID for reference and send confirmation
             context.user_data["receipt_uuid"] = receipt_path
             update.message.reply_text("Image submitted!")
-            send_user_payment_proof_confirmation(update, context)
+            confirmation = send_user_payment_proof_confirmation(update, context)
+            processed_updates.record(key, confirmation=confirmation)
+            if queued:
+                notify_submission_queued(update)
 
         except ValueError:
             handle_invalid_image(update)
+        processed_updates.record(key, completed=True)
     else:
         # If no photo is provided, ask for a valid photo
         request_valid_image(update)